@@ -7,8 +7,10 @@
 @time: 2023/2/23
 """
 
+import random
+import functools
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, Tuple, Callable
 from dataclasses import dataclass
 
 from pyraft.crypto import AbstractCryptor, AESCryptor
@@ -21,15 +23,36 @@ __all__ = ('settings',)
 @dataclass
 class Settings:
     LOG_PATH: Union[str, Path] = Path('~/.raft').expanduser()
+    # 建立sqlite连接后依次执行的PRAGMA，WAL模式下读写互不阻塞。
+    # Raft要求任期、投票及日志在响应前落盘，默认synchronous=FULL；改为NORMAL可提升写入性能，
+    # 但操作系统崩溃或断电时可能丢失已向其他节点确认的事务，仅在可接受该风险时显式开启
+    SQLITE_PRAGMAS: Tuple[str, ...] = ('journal_mode=WAL', 'synchronous=FULL', 'temp_store=MEMORY')
+    # 页缓存、mmap均按连接分配，状态表与日志表各持有一个连接，分别设置。
+    # 状态表只有任期、投票两个键，256KiB足够；日志的近期读取大多命中LogCache，8MiB页缓存足以覆盖追赶复制时的顺序读取，不开启mmap
+    SQLITE_STATE_PRAGMAS: Tuple[str, ...] = ('cache_size=-256',)
+    SQLITE_LOGS_PRAGMAS: Tuple[str, ...] = ('cache_size=-8192',)
     SERIALIZER: Optional[AbstractSerializer] = MsgPackSerializer()
 
     HEARTBEAT_INTERVAL: float = 3 * 0.1
     STEP_DOWN_MISSED_HEARTBEATS: int = 5
     ELECTION_INTERVAL_SPREAD: int = 3
     STEP_DOWN_INTERVAL: Optional[float] = None
-    ELECTION_INTERVAL: Optional[float] = None
+    ELECTION_INTERVAL: Optional[Tuple[float, float]] = None
+    ELECTION_INTERVAL_SAMPLER: Optional[Callable[[], float]] = None
 
-    APPEND_ENTRIES_MAX_NUM: Optional[int] = 3
+    APPEND_ENTRIES_MAX_NUM: Optional[int] = 32
+    # 单个AppendEntries中日志项序列化后的总字节数上限，需为消息其余字段及加密、分帧开销留出余量以不超出UDP数据报上限；
+    # 单条日志超出该上限时仍单独发送
+    APPEND_ENTRIES_MAX_BYTES: int = 60000
+    # leader合并客户端命令的等待时间(秒)，待写入命令数达到APPEND_ENTRIES_MAX_NUM时提前写入
+    APPEND_ENTRIES_BATCH_INTERVAL: float = 0.005
+    # 每个follower最多同时在途（已发送未确认）的AppendEntries批数，为1时退化为发送一批、确认后再发下一批
+    APPEND_ENTRIES_PIPELINE_DEPTH: int = 2
+    # 最近写入日志项的内存缓存容量，应不小于APPEND_ENTRIES_MAX_NUM，为0时不缓存
+    LOG_CACHE_SIZE: int = 64
+
+    # 数据报前附加4字节长度帧头，UDP下数据报自带边界，仅在需要与流式传输兼容时开启
+    FRAMING_ENABLED: bool = False
 
     CRYPTOR_ENABLED: bool = False
     CRYPTOR_SECRET: bytes = b'raftos sample secret key'
@@ -43,3 +66,4 @@ settings.ELECTION_INTERVAL = (
     settings.STEP_DOWN_INTERVAL,
     settings.STEP_DOWN_INTERVAL * settings.ELECTION_INTERVAL_SPREAD
 )
+settings.ELECTION_INTERVAL_SAMPLER = functools.partial(random.uniform, *settings.ELECTION_INTERVAL)
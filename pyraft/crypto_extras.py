@@ -0,0 +1,179 @@
+#!usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: superwong
+@project: firebird-sdk
+@file: crypto_extras.py
+@time: 2020/8/23
+"""
+
+import base64
+from typing import Optional, Tuple
+from enum import Enum
+
+from Crypto.Hash import SHA256
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Signature import PKCS1_PSS
+from Crypto.Random import get_random_bytes
+from Crypto.PublicKey import RSA
+
+from pyraft.crypto import AbstractCryptor
+
+
+__all__ = (
+    'RSAKeyFormat',
+    'RSACryptor',
+    'HybridCryptor',
+    'generate_private_key',
+    'generate_rsa_keys',
+    'get_public_key_from_private'
+)
+
+
+class RSAKeyFormat(str, Enum):
+    PEM = 'PEM'
+    DER = 'DER'
+    OpenSSH = 'OpenSSH'
+
+
+class RSACryptor(AbstractCryptor):
+    """RSA加解密"""
+    def __init__(
+            self,
+            private_key: Optional[bytes] = None,
+            public_key: Optional[bytes] = None,
+            passphrase: Optional[str] = None
+    ):
+        self._private_key = private_key
+        self._public_key = public_key
+        self._private_key_obj = RSA.import_key(private_key, passphrase=passphrase) if private_key else None
+        self._public_key_obj = RSA.import_key(
+            public_key or self._private_key_obj.public_key().export_key(), passphrase=passphrase
+        )
+
+    def encrypt(self, raw_text: bytes, length: int = 200) -> bytes:
+        """公钥加密
+        单次加密串的长度最大为：(key_size/8)-11
+        1024bit的证书用100，2048bit的证书用200
+        """
+        if not self._public_key_obj:
+            raise ValueError('加密操作时，public_key不可为空')
+
+        cipher_rsa = PKCS1_OAEP.new(self._public_key_obj)
+        raw_text_bytes = raw_text
+        enc_text_list = [cipher_rsa.encrypt(raw_text_bytes[i:i+length]) for i in range(0, len(raw_text_bytes), length)]
+        return base64.b64encode(b''.join(enc_text_list))
+
+    def decrypt(self, enc_text: bytes, length: int = 256) -> bytes:
+        """私钥解密
+        1024bit的证书用128，2048bit的证书用256
+        """
+        if not self._private_key_obj:
+            raise ValueError('解密操作时，private_key不可为空')
+
+        # Decrypt the session key with the private RSA key
+        cipher_rsa = PKCS1_OAEP.new(self._private_key_obj)
+        enc_text_bytes = base64.b64decode(enc_text)
+        raw_text_list = [cipher_rsa.decrypt(enc_text_bytes[i:i+length]) for i in range(0, len(enc_text_bytes), length)]
+        return b''.join(raw_text_list)
+
+    def signature(self, text: bytes) -> bytes:
+        """私钥签名"""
+        if not self._private_key_obj:
+            raise ValueError('签名操作时，private_key不可为空')
+        signer = PKCS1_PSS.new(self._private_key_obj)
+        digest = SHA256.new(text)
+        sign = signer.sign(digest)
+        return base64.b64encode(sign)
+
+    def verify(self, text: bytes, signature: bytes) -> bool:
+        """公钥验签"""
+        if not self._public_key_obj:
+            raise ValueError('验签操作时，public_key不可为空')
+        verifier = PKCS1_PSS.new(self._public_key_obj)
+        digest = SHA256.new(text)
+        try:
+            verifier.verify(digest, base64.b64decode(signature))
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+class HybridCryptor(AbstractCryptor):
+    """Hybrid加解密"""
+    def __init__(
+            self,
+            private_key: Optional[bytes] = None,
+            public_key: Optional[bytes] = None,
+            mode: Optional[int] = None,
+            passphrase: Optional[str] = None
+    ):
+        self._private_key = RSA.import_key(private_key, passphrase=passphrase) if private_key else None
+        self._public_key = RSA.import_key(
+            public_key or self._private_key.public_key().export_key(), passphrase=passphrase
+        )
+        self._mode = mode or AES.MODE_EAX
+        self._session_key = get_random_bytes(16)
+
+    def encrypt(self, raw_text: bytes) -> bytes:
+        if not self._public_key:
+            raise ValueError('加密操作时，public_key不可为空')
+
+        cipher_rsa = PKCS1_OAEP.new(self._public_key)
+        enc_session_key = cipher_rsa.encrypt(self._session_key)
+
+        cipher_aes = AES.new(self._session_key, self._mode)
+        ciphertext, tag = cipher_aes.encrypt_and_digest(raw_text)
+        return base64.b64encode(enc_session_key + cipher_aes.nonce + tag + ciphertext)
+
+    def decrypt(self, enc_text: bytes) -> bytes:
+        if not self._private_key:
+            raise ValueError('加密操作时，private_key不可为空')
+
+        enc_bytes = base64.b64decode(enc_text)
+        key_size = self._private_key.size_in_bytes()
+        enc_session_key, nonce, tag, ciphertext = (
+            enc_bytes[:key_size], enc_bytes[key_size:key_size + 16],
+            enc_bytes[key_size + 16:key_size + 32], enc_bytes[key_size + 32:]
+        )
+
+        # Decrypt the session key with the private RSA key
+        cipher_rsa = PKCS1_OAEP.new(self._private_key)
+        session_key = cipher_rsa.decrypt(enc_session_key)
+
+        # Decrypt the data with the AES session key
+        cipher_aes = AES.new(session_key, self._mode, nonce)
+        return cipher_aes.decrypt_and_verify(ciphertext, tag)
+
+
+def generate_private_key(
+        fmt: Optional[RSAKeyFormat] = None,
+        passphrase: Optional[str] = None,
+) -> bytes:
+    fmt = fmt or RSAKeyFormat.PEM
+    key = RSA.generate(2048)
+    encrypted_key = key.export_key(format=fmt.value, passphrase=passphrase, pkcs=8, protection="scryptAndAES128-CBC")
+    return encrypted_key
+
+
+def generate_rsa_keys(
+        fmt: Optional[RSAKeyFormat] = None,
+        passphrase: Optional[str] = None
+) -> Tuple[bytes, bytes]:
+    fmt = fmt or RSAKeyFormat.PEM
+    key = RSA.generate(2048)
+    encrypted_key = key.export_key(format=fmt.value, passphrase=passphrase, pkcs=8, protection="scryptAndAES128-CBC")
+    return encrypted_key, key.publickey().export_key(format=fmt.value)
+
+
+def get_public_key_from_private(
+        private_key: str,
+        passphrase: Optional[str] = None,
+        to_fmt: Optional[RSAKeyFormat] = None,
+        encoding: str = 'utf8'
+) -> str:
+    to_fmt = to_fmt or RSAKeyFormat.PEM
+    pk_obj = RSA.import_key(private_key, passphrase=passphrase)
+    key = pk_obj.public_key().export_key(format=to_fmt.value)
+    return key.decode(encoding)
+
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: framing
+@time: 2026/10/15
+"""
+
+import struct
+
+
+__all__ = ('FRAME_HEADER_SIZE', 'pack_frame', 'unpack_frame')
+
+
+# 帧头为4字节大端无符号整数，表示帧体长度
+FRAME_HEADER = struct.Struct('>I')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+
+def pack_frame(data: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def unpack_frame(data: bytes) -> bytes:
+    """解析单个完整的帧（如一个UDP数据报），长度与帧头不符时抛出ValueError"""
+    if len(data) < FRAME_HEADER_SIZE:
+        raise ValueError(f'数据长度[{len(data)}]小于帧头长度')
+    (size,) = FRAME_HEADER.unpack_from(data)
+    if len(data) - FRAME_HEADER_SIZE != size:
+        raise ValueError(f'帧体长度[{len(data) - FRAME_HEADER_SIZE}]与帧头声明的长度[{size}]不一致')
+    return data[FRAME_HEADER_SIZE:]
+
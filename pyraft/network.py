@@ -7,14 +7,60 @@
 @time: 2023/2/23
 """
 
+import sys
+import socket
+import struct
+import ctypes
+import ctypes.util
 import asyncio
-from typing import Union, Optional, Callable, Tuple
+from typing import Union, Optional, Callable, Tuple, Iterable, Dict
 
 from pyraft.crypto import AbstractCryptor
+from pyraft.framing import pack_frame, unpack_frame
 from pyraft.config import settings
 from pyraft.log import logger
 
 
+__all__ = ('UDPProtocol',)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_sendmmsg() -> Optional[Callable]:
+    """加载libc的sendmmsg，非Linux或加载失败时返回None，调用方回退为逐个sendto"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+
+_sendmmsg = _load_sendmmsg()
+
+
 class UDPProtocol(asyncio.DatagramProtocol):
     def __init__(
             self,
@@ -22,33 +68,98 @@ class UDPProtocol(asyncio.DatagramProtocol):
             on_con_lost: asyncio.Future,
             cryptor_enabled: Optional[bool] = False,
             cryptor: Optional[AbstractCryptor] = None,
+            framing_enabled: Optional[bool] = None,
             loop: Optional[asyncio.AbstractEventLoop] = None
     ):
         self.request_handler = request_handler
         self.on_con_lost = on_con_lost
         self.cryptor_enabled = cryptor_enabled or settings.CRYPTOR_ENABLED
         self.cryptor = cryptor or settings.CRYPTOR
-        self.loop = loop or asyncio.get_event_loop()
+        self.loop = loop or asyncio.get_running_loop()
         self.transport: Optional[asyncio.DatagramTransport] = None
+        # 是否加密在创建时即可确定，预先绑定加解密方法，收发数据时不再重复判断
+        enabled = self.cryptor_enabled and self.cryptor
+        self._encrypt: Optional[Callable[[bytes], bytes]] = self.cryptor.encrypt if enabled else None
+        self._decrypt: Optional[Callable[[bytes], bytes]] = self.cryptor.decrypt if enabled else None
+        self.framing_enabled = settings.FRAMING_ENABLED if framing_enabled is None else framing_enabled
+        # 广播地址对应的sockaddr_in缓存，None表示该地址无法直接打包（如主机名、IPv6）
+        self._sockaddr_cache: Dict[Tuple[str, int], Optional[ctypes.Array]] = {}
 
     def __call__(self):
         return self
 
-    def send(self, data: bytes, addr: Tuple[str, int]):
-        if self.cryptor_enabled and self.cryptor:
-            data = self.cryptor.encrypt(data)
+    def send(self, data: Union[bytes, memoryview], addr: Tuple[str, int]) -> bool:
+        """返回数据是否因无法立即发送而被transport暂存（此时调用方不可再修改data引用的缓冲区）"""
+        if self._encrypt is not None:
+            data = self._encrypt(data)
+        if self.framing_enabled:
+            data = pack_frame(data)
         self.transport.sendto(data, addr)
+        return self.transport.get_write_buffer_size() > 0
+
+    def broadcast(self, data: bytes, addrs: Iterable[Tuple[str, int]]):
+        """同一数据发往多个节点时只加密一次，Linux下通过一次sendmmsg系统调用发出"""
+        if self._encrypt is not None:
+            data = self._encrypt(data)
+        if self.framing_enabled:
+            data = pack_frame(data)
+        addrs = tuple(addrs)
+        sent = self._sendmmsg(data, addrs) if len(addrs) > 1 else 0
+        for addr in addrs[sent:]:
+            self.transport.sendto(data, addr)
+
+    def _get_sockaddr(self, addr: Tuple[str, int]) -> Optional[ctypes.Array]:
+        try:
+            return self._sockaddr_cache[addr]
+        except KeyError:
+            pass
+        try:
+            raw = struct.pack('=H', socket.AF_INET) + struct.pack('!H', addr[1]) + socket.inet_aton(addr[0]) + bytes(8)
+            sockaddr = ctypes.create_string_buffer(raw, len(raw))
+        except (OSError, struct.error):
+            sockaddr = None
+        self._sockaddr_cache[addr] = sockaddr
+        return sockaddr
+
+    def _sendmmsg(self, data: bytes, addrs: Tuple[Tuple[str, int], ...]) -> int:
+        """返回已发送的报文数，未发送的部分由调用方逐个sendto"""
+        # transport中仍有积压数据时不绕过其缓冲区，保持发送顺序
+        if _sendmmsg is None or self.transport.get_write_buffer_size():
+            return 0
+        sock = self.transport.get_extra_info('socket')
+        if sock is None or sock.family != socket.AF_INET:
+            return 0
+        sockaddrs = [self._get_sockaddr(addr) for addr in addrs]
+        if any(sockaddr is None for sockaddr in sockaddrs):
+            return 0
+
+        buf = ctypes.create_string_buffer(data, len(data))
+        iov = _IOVec(ctypes.cast(buf, ctypes.c_void_p), len(data))
+        hdrs = (_MMsgHdr * len(addrs))()
+        for hdr, sockaddr in zip(hdrs, sockaddrs):
+            hdr.msg_hdr.msg_name = ctypes.cast(sockaddr, ctypes.c_void_p)
+            hdr.msg_hdr.msg_namelen = len(sockaddr)
+            hdr.msg_hdr.msg_iov = ctypes.pointer(iov)
+            hdr.msg_hdr.msg_iovlen = 1
+        sent = _sendmmsg(sock.fileno(), hdrs, len(addrs), socket.MSG_DONTWAIT)
+        return max(sent, 0)
 
     def connection_made(self, transport: asyncio.DatagramTransport) -> None:
         self.transport = transport
 
     def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
-        if self.cryptor_enabled and self.cryptor:
-            data = self.cryptor.decrypt(data)
+        if self.framing_enabled:
+            try:
+                data = unpack_frame(data)
+            except ValueError as e:
+                logger.warning('丢弃来自%s的数据报：%s', addr, e)
+                return
+        if self._decrypt is not None:
+            data = self._decrypt(data)
         self.request_handler(data, addr)
 
     def error_received(self, exc: Exception) -> None:
-        logger.error('Error received {}'.format(exc))
+        logger.error('Error received %s', exc)
         self.transport.abort()
 
     def connection_lost(self, exc: Union[Exception, None]) -> None:
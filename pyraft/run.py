@@ -8,42 +8,65 @@
 """
 
 import asyncio
+import functools
 from typing import Optional, Union, List, Tuple, Iterator
 
 from pyraft.log import logger
 from pyraft.server import Server
 from pyraft.state import Leader, Follower, Candidate
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 def parser_server_str(
         servers: Union[str, Iterator[str], Iterator[Tuple[str, int]]]
 ) -> List[Tuple[str, int]]:
+    # 列表入参先转换为可哈希的元组再走缓存，返回新列表避免调用方修改缓存结果
+    if isinstance(servers, (list, tuple)):
+        servers = tuple(tuple(server) if isinstance(server, list) else server for server in servers)
+    return list(_parser_server_str(servers))
+
+
+@functools.lru_cache(maxsize=8)
+def _parser_server_str(
+        servers: Union[str, Tuple[Union[str, Tuple[str, int]], ...]]
+) -> Tuple[Tuple[str, int], ...]:
     server_list = []
     if isinstance(servers, str):
         for server in servers.split(','):
             host, port = server.rsplit(':', 1)
             server_list.append((host, int(port)))
-    elif isinstance(servers, (list, tuple)):
+    elif isinstance(servers, tuple):
         for server in servers:
             if isinstance(server, str):
                 host, port = server.rsplit(':', 1)
                 server_list.append((host, int(port)))
-            elif isinstance(server, (list, tuple)):
+            elif isinstance(server, tuple):
                 host, port = server
                 server_list.append((host, int(port)))
-    return server_list
+    return tuple(server_list)
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """创建事件循环，已安装uvloop时优先使用（未安装或Windows下回退为asyncio默认事件循环）"""
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
 
 
 def leader_listener(role: Leader):
-    logger.info(f'当前服务切换为leader，ID为{role.id}')
+    logger.info('当前服务切换为leader，ID为%s', role.id)
 
 
 def follower_listener(role: Follower):
-    logger.info(f'当前服务切换为follower，ID为{role.id}')
+    logger.info('当前服务切换为follower，ID为%s', role.id)
 
 
 def candidate_listener(role: Candidate):
-    logger.info(f'当前服务切换为candidate，ID为{role.id}')
+    logger.info('当前服务切换为candidate，ID为%s', role.id)
 
 
 async def start(
@@ -51,14 +74,14 @@ async def start(
         current_server_index: int,
         loop: Optional[asyncio.AbstractEventLoop] = None
 ):
-    loop = loop or asyncio.get_event_loop()
+    loop = loop or asyncio.get_running_loop()
     servers = parser_server_str(servers)
     if current_server_index >= len(servers):
         raise IndexError(f'设置的当前服务器索引参数current_server_index[{current_server_index}]越界')
-    addr = servers.pop(current_server_index)
-    current_server = Server(addr, loop=loop)
-    for addr in servers:
-        current_server.update_cluster(addr)
+    current_server = Server(servers[current_server_index], loop=loop)
+    for index, addr in enumerate(servers):
+        if index != current_server_index:
+            current_server.update_cluster(addr)
     current_server.add_leader_listener(leader_listener)
     current_server.add_follower_listener(follower_listener)
     current_server.add_candidate_listener(candidate_listener)
@@ -66,5 +89,6 @@ async def start(
 
 
 def stop():
-    for server in Server.servers:
+    # stop()会从Server.servers中移除自身，先复制再遍历
+    for server in list(Server.servers):
         server.stop()
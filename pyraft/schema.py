@@ -7,77 +7,179 @@
 @time: 2023/2/28
 """
 
-from typing import Union, Optional, Dict, Any
-from dataclasses import dataclass, asdict
-from collections import namedtuple
+from typing import Union, Dict, Any, List, Callable, Type, Optional
+
+import msgspec
+
+from pyraft.config import settings
+from pyraft.serializer import AbstractSerializer, JsonSerializer, MsgPackSerializer, JSON_ENCODER, MSGPACK_ENCODER
 
 
 __all__ = (
-    'rpc_request_mapping', 'LogEntry', 'RequestVote', 'RequestVoteResponse', 'AppendEntries', 'AppendEntriesResponse'
+    'REQUEST_ID_MAX', 'PackedSchema', 'LogEntry', 'RequestVote', 'RequestVoteResponse', 'AppendEntries',
+    'AppendEntriesResponse', 'RPCMessage', 'RPC_HANDLER_NAMES', 'get_rpc_decoder', 'LogRecord', 'get_log_entry_decoder'
 )
 
+# request_id为循环使用的uint32计数器，msgpack最多以5字节编码
+REQUEST_ID_MAX = 0xFFFFFFFF
+
+# 未配置SERIALIZER时使用的默认序列化器，避免每次序列化都创建新实例
+DEFAULT_SERIALIZER = JsonSerializer()
+
+# 基于msgspec的内置序列化器可直接编码消息对象，其余序列化器只接收由内置类型组成的数组
+BUILTIN_SERIALIZERS = (JsonSerializer, MsgPackSerializer)
 
-@dataclass
-class LogEntry:
+
+def _to_serializable(message: 'PackedSchema', serializer: AbstractSerializer) -> Any:
+    return message if isinstance(serializer, BUILTIN_SERIALIZERS) else msgspec.to_builtins(message)
+
+
+class LogEntry(msgspec.Struct, frozen=True, array_like=True):
+    """日志项以[term, command]数组形式编码，避免每一项重复编码字段名"""
     term: int
     command: Dict[str, Any]
 
     def to_dict(self) -> Dict:
-        return asdict(self)
+        return {'term': self.term, 'command': self.command}
 
 
-@dataclass
-class RequestVote:
+class LogRecord(msgspec.Struct):
+    """日志项落库时的格式，与LogEntry.to_dict()一致，仅用于按类型解码库中的数据"""
+    term: int
+    command: Dict[str, Any]
+
+
+class PackedSchema(msgspec.Struct, frozen=True, dict=True, tag_field='type', array_like=True):
+    """RPC消息基类
+
+    消息按字段定义顺序编码为定长数组，首个元素为消息类型标签，不再逐条编码字段名，标签不占用实例属性。
+    消息创建后不再修改，序列化结果缓存在实例上，重复发送时无需再次序列化
+    """
+
+    def to_dict(self) -> Dict:
+        return msgspec.structs.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        # 按数组格式转换，嵌套的日志项等字段同样完成类型校验
+        return msgspec.convert(
+            [cls.__struct_config__.tag, *(data[field] for field in cls.__struct_fields__)], cls
+        )
+
+    def to_packed(self) -> bytes:
+        try:
+            return self.__dict__['_packed']
+        except KeyError:
+            serializer = settings.SERIALIZER or DEFAULT_SERIALIZER
+            packed = self.__dict__['_packed'] = serializer.pack(_to_serializable(self, serializer))
+            return packed
+
+    def pack_into(self, buffer: bytearray) -> int:
+        """序列化到复用的缓冲区中，用于只发送一次、无需缓存序列化结果的消息"""
+        serializer = settings.SERIALIZER or DEFAULT_SERIALIZER
+        return serializer.pack_into(_to_serializable(self, serializer), buffer)
+
+
+class RequestVote(PackedSchema, tag='request_vote'):
     term: int
     candidate_id: str
     last_log_index: int
     last_log_term: int
-    type: Optional[str] = 'request_vote'
 
-    def to_dict(self) -> Dict:
-        return asdict(self)
 
-
-@dataclass
-class RequestVoteResponse:
+class RequestVoteResponse(PackedSchema, tag='request_vote_response'):
     term: int
     vote_granted: bool
-    type: Optional[str] = 'request_vote_response'
-
-    def to_dict(self):
-        return asdict(self)
 
 
-@dataclass
-class AppendEntries:
+class AppendEntries(PackedSchema, tag='append_entries'):
     term: int
     leader_id: Union[str, int]
     prev_log_index: int
     prev_log_term: int
-    entries: list[LogEntry]
+    entries: List[LogEntry]
     leader_commit: int
     request_id: int
-    type: Optional[str] = 'append_entries'
-
-    def to_dict(self):
-        return asdict(self)
-
 
-@dataclass
-class AppendEntriesResponse:
+    def __post_init__(self):
+        if not 0 <= self.request_id <= REQUEST_ID_MAX:
+            raise ValueError(f'request_id[{self.request_id}]超出uint32范围')
+
+    def pack_without_request_id(self) -> Optional[bytes]:
+        """request_id为最后一个字段，返回去掉其编码后的序列化结果，之后可按新的request_id拼接出完整消息
+
+        仅内置序列化器可确定字段的编码位置，其余序列化器返回None
+        """
+        serializer = settings.SERIALIZER or DEFAULT_SERIALIZER
+        if isinstance(serializer, MsgPackSerializer):
+            return self.to_packed()[:-len(MSGPACK_ENCODER.encode(self.request_id))]
+        if isinstance(serializer, JsonSerializer):
+            # JSON数组末尾另有一个"]"
+            return self.to_packed()[:-len(JSON_ENCODER.encode(self.request_id)) - 1]
+        return None
+
+    @staticmethod
+    def pack_with_request_id(prefix: bytes, request_id: int) -> bytes:
+        """在pack_without_request_id的结果后拼接request_id"""
+        if not 0 <= request_id <= REQUEST_ID_MAX:
+            raise ValueError(f'request_id[{request_id}]超出uint32范围')
+        if isinstance(settings.SERIALIZER or DEFAULT_SERIALIZER, MsgPackSerializer):
+            return prefix + MSGPACK_ENCODER.encode(request_id)
+        return prefix + JSON_ENCODER.encode(request_id) + b']'
+
+
+class AppendEntriesResponse(PackedSchema, tag='append_entries_response'):
     term: int
     success: bool
     last_log_index: int
     last_log_term: int
     request_id: int
-    type: Optional[str] = 'append_entries_response'
 
-    def to_dict(self) -> Dict:
-        return asdict(self)
 
+RPCMessage = Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse]
 
-RPCRequestMapping = namedtuple(
-    'RPCRequestMapping', ['request_vote', 'request_vote_response', 'append_entries', 'append_entries_response']
-)
+# 消息类型对应的角色处理方法名
+RPC_HANDLER_NAMES: Dict[Type[PackedSchema], str] = {
+    RequestVote: 'on_receive_request_vote',
+    RequestVoteResponse: 'on_receive_request_vote_response',
+    AppendEntries: 'on_receive_append_entries',
+    AppendEntriesResponse: 'on_receive_append_entries_response'
+}
+
+# 按首个元素的类型标签直接解码为对应的消息类型，标签匹配及字段校验均在msgspec中完成
+RPC_MSGPACK_DECODER = msgspec.msgpack.Decoder(RPCMessage)
+RPC_JSON_DECODER = msgspec.json.Decoder(RPCMessage)
+
+
+def get_rpc_decoder(serializer: AbstractSerializer) -> Callable[[bytes], RPCMessage]:
+    """返回与序列化器匹配的消息解码函数，数据格式或标签非法时抛出msgspec.DecodeError"""
+    if isinstance(serializer, MsgPackSerializer):
+        return RPC_MSGPACK_DECODER.decode
+    if isinstance(serializer, JsonSerializer):
+        return RPC_JSON_DECODER.decode
+
+    def decode(data: bytes) -> RPCMessage:
+        # 其他序列化器收发的是msgspec.to_builtins生成的[标签, 字段...]数组，按数组格式转换为对应的消息类型
+        return msgspec.convert(serializer.unpack(data), RPCMessage)
+    return decode
+
+
+LOG_RECORD_MSGPACK_DECODER = msgspec.msgpack.Decoder(LogRecord)
+LOG_RECORD_JSON_DECODER = msgspec.json.Decoder(LogRecord)
+
+
+def get_log_entry_decoder(serializer: AbstractSerializer) -> Callable[[bytes], LogEntry]:
+    """返回与序列化器匹配的日志项解码函数，内置序列化器直接按LogRecord解码，不再经过通用字典"""
+    if isinstance(serializer, MsgPackSerializer):
+        decode_record = LOG_RECORD_MSGPACK_DECODER.decode
+    elif isinstance(serializer, JsonSerializer):
+        decode_record = LOG_RECORD_JSON_DECODER.decode
+    else:
+        def decode(data: bytes) -> LogEntry:
+            return LogEntry(**serializer.unpack(data))
+        return decode
 
-rpc_request_mapping = RPCRequestMapping(RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse)
+    def decode(data: bytes) -> LogEntry:
+        record = decode_record(data)
+        return LogEntry(record.term, record.command)
+    return decode
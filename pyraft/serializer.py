@@ -7,12 +7,10 @@
 @time: 2023/2/17
 """
 
-import json
-import base64
 from abc import ABCMeta, abstractmethod
 from typing import Optional, AnyStr, Dict
 
-import msgpack
+import msgspec
 
 
 class AbstractSerializer(metaclass=ABCMeta):
@@ -27,18 +25,52 @@ class AbstractSerializer(metaclass=ABCMeta):
     def unpack(self, data: AnyStr) -> Dict:
         ...
 
+    def pack_into(self, data: Dict, buffer: bytearray) -> int:
+        """序列化到已有的bytearray中（buffer被截断为序列化结果），返回写入的字节数"""
+        packed = self.pack(data)
+        buffer[:] = packed
+        return len(packed)
+
+
+JSON_ENCODER = msgspec.json.Encoder()
+JSON_DECODER = msgspec.json.Decoder()
+
 
 class JsonSerializer(AbstractSerializer):
+    def __init__(self, encoding: Optional[str] = 'utf-8'):
+        super().__init__(encoding)
+        self._encode = JSON_ENCODER.encode
+        self._encode_into = JSON_ENCODER.encode_into
+        self._decode = JSON_DECODER.decode
+
     def pack(self, data: Dict) -> bytes:
-        return json.dumps(data).encode(self.encoding)
+        return self._encode(data)
+
+    def pack_into(self, data: Dict, buffer: bytearray) -> int:
+        self._encode_into(data, buffer)
+        return len(buffer)
 
     def unpack(self, data: bytes) -> Dict:
-        return json.loads(data)
+        return self._decode(data)
+
+
+MSGPACK_ENCODER = msgspec.msgpack.Encoder()
+MSGPACK_DECODER = msgspec.msgpack.Decoder()
 
 
 class MsgPackSerializer(AbstractSerializer):
+    def __init__(self, encoding: Optional[str] = 'utf-8'):
+        super().__init__(encoding)
+        self._encode = MSGPACK_ENCODER.encode
+        self._encode_into = MSGPACK_ENCODER.encode_into
+        self._decode = MSGPACK_DECODER.decode
+
     def pack(self, data: Dict) -> bytes:
-        return base64.b64encode(msgpack.packb(data, use_bin_type=True))
+        return self._encode(data)
+
+    def pack_into(self, data: Dict, buffer: bytearray) -> int:
+        self._encode_into(data, buffer)
+        return len(buffer)
 
     def unpack(self, data: bytes) -> Dict:
-        return msgpack.unpackb(base64.b64decode(data), use_list=True)
+        return self._decode(data)
@@ -8,19 +8,26 @@
 """
 
 import asyncio
-from typing import Optional, Union, Tuple, Set, Callable
+import weakref
+from typing import Optional, Union, Tuple, Callable, Dict, ClassVar, List
 
 from pyraft.state import State, Follower, Candidate, Leader
 from pyraft.network import UDPProtocol
 
 
 class Server:
-    servers = set()
+    # 弱引用集合，已停止且不再被引用的Server会自动移除
+    servers: ClassVar['weakref.WeakSet[Server]'] = weakref.WeakSet()
 
     def __init__(self, addr: Tuple[str, int], loop: Optional[asyncio.AbstractEventLoop] = None):
         self.addr = addr
-        self.loop = loop or asyncio.get_event_loop()
-        self.cluster: Set[Tuple[str, int]] = set()
+        self.loop = loop or asyncio.get_running_loop()
+        self.cluster: Tuple[Tuple[str, int], ...] = ()
+        # 节点ID（host:port）到地址的映射，在加入集群时解析一次，发送时不再拆分字符串
+        self.cluster_addrs: Dict[str, Tuple[str, int]] = {}
+        # 集群成员变化时重新计算：其他节点ID列表，及过半所需超过的节点数（含当前节点）
+        self.cluster_ids: Tuple[str, ...] = ()
+        self.majority_threshold: int = 0
         self.state = State(self)
         self.udp_protocol: Optional[UDPProtocol] = None
         self.udp_transport: Optional[asyncio.DatagramTransport] = None
@@ -33,9 +40,18 @@ class Server:
     def stop(self):
         self.state.stop()
         self.udp_transport.close()
+        self.__class__.servers.discard(self)
 
     def update_cluster(self, addr: Tuple[str, int]):
-        self.cluster.add(addr)
+        addr = (addr[0], int(addr[1]))
+        if addr not in self.cluster:
+            self.cluster = self.cluster + (addr,)
+            self.cluster_addrs[State.get_server_id(*addr)] = addr
+            self.refresh_cluster()
+
+    def refresh_cluster(self):
+        self.cluster_ids = tuple(self.cluster_addrs)
+        self.majority_threshold = (len(self.cluster) + 1) // 2
 
     def request_handler(self, data: bytes, sender: Tuple[str, int]) -> None:
         self.state.request_handler(data, sender)
@@ -48,19 +64,31 @@ class Server:
                 self.udp_transport.close()
                 await self.create_udp_endpoint(addr)
 
-        on_con_lost = asyncio.Future(loop=self.loop)
+        on_con_lost = self.loop.create_future()
         self.udp_protocol = UDPProtocol(self.request_handler, on_con_lost, loop=self.loop)
         self.udp_transport, _ = await self.loop.create_datagram_endpoint(self.udp_protocol, local_addr=addr)
-        asyncio.ensure_future(transport_listener(), loop=self.loop)
+        self.loop.create_task(transport_listener())
 
     def send(self, data: bytes, dest: Union[str, Tuple[str, int]]):
         if isinstance(dest, str):
-            host, port = dest.split(':')
-            dest = (host, int(port))
-        self.udp_protocol.send(data, dest)
-
-    def broadcast(self, data: bytes):
-        [self.send(data, dest) for dest in self.cluster]
+            self.send_str(data, dest)
+        else:
+            self.send_addr(data, dest)
+
+    def send_addr(self, data: Union[bytes, memoryview], dest: Tuple[str, int]) -> bool:
+        return self.udp_protocol.send(data, dest)
+
+    def send_str(self, data: bytes, dest: str):
+        try:
+            addr = self.cluster_addrs[dest]
+        except KeyError:
+            host, port = dest.rsplit(':', 1)
+            addr = (host, int(port))
+        self.udp_protocol.send(data, addr)
+
+    def broadcast(self, data: bytes, dests: Optional[List[str]] = None):
+        addrs = self.cluster if dests is None else [self.cluster_addrs[dest] for dest in dests]
+        self.udp_protocol.broadcast(data, addrs)
 
     @staticmethod
     def add_follower_listener(callback: Callable[['Follower'], None]):
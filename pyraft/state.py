@@ -7,80 +7,90 @@
 @time: 2023/2/17
 """
 
-import random
 import asyncio
+import logging
 import functools
 from abc import ABCMeta, abstractmethod
-from typing import Union, Dict, Type, Callable, Tuple, Optional, List, Any, ByteString
+from typing import Union, Dict, Type, Callable, Tuple, Optional, List, Any, ByteString, Set, Iterable
 from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 
+import msgspec
+
 from pyraft.storage import StateStorage, LogsStorage, StateMachine
 from pyraft.timer import Timer
 from pyraft.config import settings
 from pyraft.log import logger
-from pyraft.schema import rpc_request_mapping, LogEntry, RequestVote, RequestVoteResponse, AppendEntries, \
-    AppendEntriesResponse
-
-
-THREAD_POOL_EXECUTOR = ThreadPoolExecutor()
-
-
-def validate_term(func):
-    @functools.wraps(func)
-    def wrapped(
-            role: 'BaseRole',
-            data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
-            sender: Tuple[str, int]
-    ):
-        if data.term > role.storage.current_term:
-            role.storage.current_term = data.term
-            if not isinstance(role, Follower):
-                # TODO 需要测试变更为follower后，是否会执行新的follower的func
-                role.state.to_follower()
-        elif data.term < role.storage.current_term:
-            if isinstance(data, RequestVote):
-                response = RequestVoteResponse(term=role.storage.current_term, vote_granted=False)
-                role.state.send(response.to_dict(), sender)
-                return
-            elif isinstance(data, AppendEntries):
-                response = AppendEntriesResponse(
-                    term=role.storage.current_term,
-                    success=False,
-                    last_log_index=role.log.last_log_index,
-                    last_log_term=role.log.last_log_term,
-                    request_id=data.request_id
-                )
-                role.state.send(response.to_dict(), sender)
-                return
-        return func(role, data, sender)
-    return wrapped
-
-
-def validate_commit_index(func):
-    @functools.wraps(func)
-    def wrapped(
-            role: 'BaseRole',
-            data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
-            sender: Tuple[str, int]
-    ):
-        result = func(role, data, sender)
-        if role.log.commit_index > role.log.last_applied:
-            for not_applied in range(role.log.last_applied + 1, role.log.commit_index + 1):
-                command = role.log[not_applied]['command']
-                role.state_machine.apply(command)
-                logger.debug(f'日志序列[{not_applied}]中command[{command}]已应用到状态机中')
-                role.log.last_applied += 1
-                if isinstance(role, Leader) and not_applied in role.apply_future_dict:
-                    logger.info(f'日志序列[{not_applied}]已提交')
-                    try:
-                        apply_future: asyncio.Future = role.apply_future_dict.pop(not_applied)
-                        if not apply_future.done():
-                            apply_future.set_result(not_applied)
-                    except (asyncio.futures.InvalidStateError, AttributeError):
-                        pass
-        return result
-    return wrapped
+from pyraft.schema import REQUEST_ID_MAX, RPC_HANDLER_NAMES, get_rpc_decoder, PackedSchema, LogEntry, RequestVote, \
+    RequestVoteResponse, AppendEntries, AppendEntriesResponse
+
+
+# 仅用于leader批量写入日志，单线程即可保证按提交顺序写入；发送等其余操作均在事件循环中直接执行
+THREAD_POOL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pyraft-log')
+
+
+def _reject_stale_request_vote(role: 'BaseRole', data: RequestVote, sender: Tuple[str, int], current_term: int):
+    role.state.reply(RequestVoteResponse(term=current_term, vote_granted=False), sender)
+
+
+def _reject_stale_append_entries(role: 'BaseRole', data: AppendEntries, sender: Tuple[str, int], current_term: int):
+    response = AppendEntriesResponse(
+        term=current_term,
+        success=False,
+        last_log_index=role.log.last_log_index,
+        last_log_term=role.log.last_log_term,
+        request_id=data.request_id
+    )
+    role.state.reply(response, sender)
+
+
+def _fail_futures(futures: Iterable[asyncio.Future], error: BaseException):
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
+
+
+# 过期任期的请求按消息类型直接查表回复拒绝，响应类消息不在表中，由rpc_handler直接丢弃、不再交给处理方法
+STALE_REJECTORS: Dict[Type[PackedSchema], Callable[['BaseRole', Any, Tuple[str, int], int], None]] = {
+    RequestVote: _reject_stale_request_vote,
+    AppendEntries: _reject_stale_append_entries
+}
+
+
+def rpc_handler(apply_commits: bool = False):
+    """RPC处理方法装饰器，在同一层包装中完成任期校验及（可选的）已提交日志应用
+
+    :param apply_commits: 处理完成后是否将已提交未应用的日志应用到状态机，不涉及日志提交的处理方法无需开启
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapped(
+                role: 'BaseRole',
+                data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
+                sender: Tuple[str, int]
+        ):
+            current_term = role.storage.current_term
+            if data.term > current_term:
+                # 进入新任期，本任期尚未投票
+                role.storage.current_term = data.term
+                role.storage.voted_for = None
+                if not role.is_follower:
+                    role.state.to_follower()
+                    # 由新的follower处理该消息，避免丢弃更高任期的投票请求等
+                    return getattr(role.state.role, name)(data, sender)
+            elif data.term < current_term:
+                reject = STALE_REJECTORS.get(type(data))
+                if reject is not None:
+                    reject(role, data, sender, current_term)
+                return None
+            result = func(role, data, sender)
+            if apply_commits and role.log.commit_index > role.log.last_applied:
+                role.apply_committed()
+            return result
+        return wrapped
+    return decorator
 
 
 def leader_required(func):
@@ -113,14 +123,20 @@ class State:
         self.storage = StateStorage(self.id)
         self.log = LogsStorage(self.id)
         self.state_machine = StateMachine()
+        self._decode = get_rpc_decoder(self.log.serializer)
+        # 回复消息的发送缓冲区，序列化结果直接写入其中，不再为每条回复创建bytes对象；按需增长，之后复用已分配的空间
+        self._txbuf = bytearray()
 
-        self.role = Follower(self)
+        self._set_role(Follower(self))
 
     def start(self):
         self.role.start()
 
     def stop(self):
         self.role.stop()
+        # 日志写入都在单线程执行器中排队，关闭也排进去，等此前的写入完成后再关连接
+        THREAD_POOL_EXECUTOR.submit(self.log.close).result()
+        self.storage.close()
 
     @staticmethod
     def get_server_id(host: str, port: int) -> str:
@@ -132,9 +148,16 @@ class State:
 
     def _change_role(self, new_role: Type['BaseRole']):
         self.role.stop()
-        self.role = new_role(self)
+        self._set_role(new_role(self))
         self.role.start()
 
+    def _set_role(self, role: 'BaseRole'):
+        self.role = role
+        # 切换角色时按消息类型一次绑定处理方法，收到消息时直接查表
+        self._handlers: Dict[Type[PackedSchema], Callable[[Any, Tuple[str, int]], None]] = {
+            message_type: getattr(role, name) for message_type, name in RPC_HANDLER_NAMES.items()
+        }
+
     @property
     def leader_id(self):
         cls = self.__class__
@@ -151,69 +174,84 @@ class State:
         ) and self.leader_id == cls.wait_until_leader_id:
             cls.wait_until_leader_future.set_result(cls.leader)
 
+    @staticmethod
+    def _as_sync_callback(callback: Optional[Callable[['BaseRole'], Any]]) -> Optional[Callable[['BaseRole'], None]]:
+        """注册时即把协程回调包装为创建任务的普通函数，角色切换时不再判断回调类型"""
+        if not callable(callback):
+            return None
+        if not asyncio.iscoroutinefunction(callback):
+            return callback
+
+        @functools.wraps(callback)
+        def wrapped(role: 'BaseRole'):
+            role.loop.create_task(callback(role))
+        return wrapped
+
     @classmethod
     def add_follower_listener(cls, callback: Callable[['Follower'], None]):
-        cls.on_follower_callback = callback
+        cls.on_follower_callback = cls._as_sync_callback(callback)
 
     @classmethod
     def add_candidate_listener(cls, callback: Callable[['Candidate'], None]):
-        cls.on_candidate_callback = callback
+        cls.on_candidate_callback = cls._as_sync_callback(callback)
 
     @classmethod
     def add_leader_listener(cls, callback: Callable[['Leader'], None]):
-        cls.on_leader_callback = callback
+        cls.on_leader_callback = cls._as_sync_callback(callback)
 
     def to_follower(self):
         self._change_role(Follower)
         self.set_leader(None)
-        if callable(self.__class__.on_follower_callback):
-            if asyncio.iscoroutinefunction(self.__class__.on_follower_callback):
-                asyncio.ensure_future(self.__class__.on_follower_callback(self.role), loop=self.loop)
-            else:
-                self.__class__.on_follower_callback(self.role)
+        callback = self.__class__.on_follower_callback
+        if callback is not None:
+            callback(self.role)
 
     def to_candidate(self):
         self._change_role(Candidate)
         self.set_leader(None)
-        if callable(self.__class__.on_candidate_callback):
-            if asyncio.iscoroutinefunction(self.__class__.on_candidate_callback):
-                asyncio.ensure_future(self.__class__.on_candidate_callback(self.role), loop=self.loop)
-            else:
-                self.__class__.on_candidate_callback(self.role)
+        callback = self.__class__.on_candidate_callback
+        if callback is not None:
+            callback(self.role)
 
     def to_leader(self):
         self._change_role(Leader)
         self.set_leader(self.role)
-        if callable(self.__class__.on_leader_callback):
-            if asyncio.iscoroutinefunction(self.__class__.on_leader_callback):
-                asyncio.ensure_future(self.__class__.on_leader_callback(self.role), loop=self.loop)
-            else:
-                self.__class__.on_leader_callback(self.role)
+        callback = self.__class__.on_leader_callback
+        if callback is not None:
+            callback(self.role)
+
+    def send(self, data: PackedSchema, dest: str):
+        self.server.send_str(data.to_packed(), dest)
+
+    def reply(self, data: PackedSchema, sender: Tuple[str, int]):
+        """回复请求方，sender为收到数据报时的地址元组，无需再解析"""
+        data.pack_into(self._txbuf)
+        if self.server.send_addr(memoryview(self._txbuf), sender):
+            # transport仍持有该缓冲区，换用新的缓冲区
+            self._txbuf = bytearray()
 
-    def send(self, data: Dict, dest: Union[str, Tuple[str, int]]):
-        data = self.log.serializer.pack(data)
-        self.server.send(data, dest)
+    def broadcast(self, data: PackedSchema, dests: Optional[List[str]] = None):
+        """dests为节点ID列表，为空时发往集群中全部其他节点"""
+        self.server.broadcast(data.to_packed(), dests)
 
-    def broadcast(self, data: Dict):
-        data = self.log.serializer.pack(data)
-        self.server.broadcast(data)
+    def broadcast_packed(self, packed: bytes, dests: Optional[List[str]] = None):
+        """发送已序列化的消息"""
+        self.server.broadcast(packed, dests)
 
     def request_handler(self, data: ByteString, sender: Tuple[str, int]):
-        data = self.log.serializer.unpack(data)
-        request_type = data.get('type')
-        if not request_type or not hasattr(rpc_request_mapping, request_type):
+        try:
+            message = self._decode(data)
+        except msgspec.DecodeError as e:
+            logger.warning('丢弃来自%s的非法消息：%s', sender, e)
             return
-        dc = getattr(rpc_request_mapping, request_type)
-        handler = getattr(self.role, f'on_receive_{request_type}', None)
-        if handler:
-            handler(dc(**data), sender)
+        self._handlers[type(message)](message, sender)
 
     def is_majority(self, count: int) -> bool:
-        return count > (len(self.server.cluster) // 2)
+        return count > self.server.majority_threshold
 
     @property
-    def cluster(self) -> List[str]:
-        return [self.get_server_id(*follower) for follower in self.server.cluster]
+    def cluster(self) -> Tuple[str, ...]:
+        return self.server.cluster_ids
 
     @classmethod
     def get_leader(cls):
@@ -222,7 +260,7 @@ class State:
     @classmethod
     async def wait_for_election_success(cls):
         if cls.leader is None:
-            cls.leader_future = asyncio.Future(loop=cls.loop)
+            cls.leader_future = (cls.loop or asyncio.get_running_loop()).create_future()
             await cls.leader_future
             cls.leader_future = None
 
@@ -232,7 +270,7 @@ class State:
             raise ValueError('节点ID不可为空')
         if cls.get_leader() != server_id:
             cls.wait_until_leader_id = server_id
-            cls.wait_until_leader_future = asyncio.Future(loop=cls.loop)
+            cls.wait_until_leader_future = (cls.loop or asyncio.get_running_loop()).create_future()
             await cls.wait_until_leader_future
             cls.wait_until_leader_id = None
             cls.wait_until_leader_future = None
@@ -246,10 +284,13 @@ class State:
     @leader_required
     async def set_value(cls, name: str, value: Any):
         await cls.leader.execute_command({name: value})
-        logger.debug(f'参数{name}已设置为{value}')
+        logger.debug('参数%s已设置为%s', name, value)
 
 
 class BaseRole(metaclass=ABCMeta):
+    # 以类属性标识角色，任期校验时无需isinstance判断
+    is_follower = False
+
     def __init__(self, state: State):
         self.state = state
 
@@ -267,7 +308,17 @@ class BaseRole(metaclass=ABCMeta):
     def stop(self):
         ...
 
-    @validate_term
+    def apply_committed(self):
+        # 一次读取全部已提交未应用的日志并批量应用
+        first_index, commit_index = self.log.last_applied + 1, self.log.commit_index
+        commands = [entry.command for entry in self.log.get_entries(first_index, commit_index)]
+        self.state_machine.apply_batch(commands)
+        self.log.last_applied = commit_index
+        if logger.isEnabledFor(logging.DEBUG):
+            for index, command in enumerate(commands, start=first_index):
+                logger.debug('日志序列[%s]中command[%s]已应用到状态机中', index, command)
+
+    @rpc_handler()
     def on_receive_request_vote(
             self,
             data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
@@ -275,7 +326,7 @@ class BaseRole(metaclass=ABCMeta):
     ):
         ...
 
-    @validate_term
+    @rpc_handler()
     def on_receive_request_vote_response(
             self,
             data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
@@ -283,8 +334,7 @@ class BaseRole(metaclass=ABCMeta):
     ):
         ...
 
-    @validate_commit_index
-    @validate_term
+    @rpc_handler(apply_commits=True)
     def on_receive_append_entries(
             self,
             data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
@@ -292,8 +342,7 @@ class BaseRole(metaclass=ABCMeta):
     ):
         ...
 
-    @validate_commit_index
-    @validate_term
+    @rpc_handler(apply_commits=True)
     def on_receive_append_entries_response(
             self,
             data: Union[RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse],
@@ -303,6 +352,8 @@ class BaseRole(metaclass=ABCMeta):
 
 
 class Follower(BaseRole):
+    is_follower = True
+
     def __init__(self, state: State):
         super().__init__(state)
         self.heartbeat_timer = Timer(self.election_interval(), self.start_election, loop=self.loop)
@@ -317,74 +368,100 @@ class Follower(BaseRole):
     def init_storage(self):
         if not self.storage.exists('current_term'):
             self.storage.current_term = 0
-        self.storage.voted_for = None
+        # 投票记录只在任期变化时清空，同一任期内切换角色不可重新投票
+        if not self.storage.exists('voted_for'):
+            self.storage.voted_for = None
 
     @staticmethod
     def election_interval():
-        return random.uniform(*settings.ELECTION_INTERVAL)
+        return settings.ELECTION_INTERVAL_SAMPLER()
 
     def start_election(self):
         self.state.to_candidate()
 
-    @validate_commit_index
-    @validate_term
+    @rpc_handler(apply_commits=True)
     def on_receive_append_entries(self, data: AppendEntries, sender: Tuple[str, int]):
         self.state.set_leader(data.leader_id)
 
-        if self.log.last_log_index < data.prev_log_index \
-                or (data.prev_log_index and self.log[data.prev_log_index]['term'] != data.prev_log_term):
+        last_log_index = self.log.last_log_index
+        if last_log_index < data.prev_log_index \
+                or (data.prev_log_index and self.log.term_at(data.prev_log_index) != data.prev_log_term):
             response = AppendEntriesResponse(
                 term=self.storage.current_term,
                 success=False,
-                last_log_index=self.log.last_log_index,
+                last_log_index=last_log_index,
                 last_log_term=self.log.last_log_term,
                 request_id=data.request_id
             )
-            self.state.send(response.to_dict(), sender)
+            self.state.reply(response, sender)
             return
 
-        if self.log.last_log_index > data.prev_log_index:
-            self.log.erase_from(data.prev_log_index)
-
-        self.log.append_entries(data.entries)
-        if data.leader_commit > self.log.commit_index:
-            self.log.commit_index = min(data.leader_commit, self.log.last_log_index)
+        # 整批日志一次写入：跳过已存在且任期一致的项，仅从第一个冲突（或缺失）的位置起截断并追加
+        new_entries = []
+        for offset, entry in enumerate(data.entries):
+            index = data.prev_log_index + 1 + offset
+            if index > last_log_index:
+                new_entries = data.entries[offset:]
+                break
+            if self.log.term_at(index) != entry.term:
+                self.log.erase_from(index - 1)
+                new_entries = data.entries[offset:]
+                break
+        if new_entries:
+            self.log.append_entries(new_entries)
+
+        # 本批覆盖到的最后一条日志，整批只回复一次
+        match_index = data.prev_log_index + len(data.entries)
+        # 乱序到达的旧请求覆盖范围较小，commit_index只前进不回退
+        commit_index = min(data.leader_commit, match_index)
+        if commit_index > self.log.commit_index:
+            self.log.commit_index = commit_index
 
         response = AppendEntriesResponse(
             term=self.storage.current_term,
             success=True,
-            last_log_index=self.log.last_log_index,
-            last_log_term=self.log.last_log_term,
+            last_log_index=match_index,
+            last_log_term=data.entries[-1].term if data.entries else data.prev_log_term,
             request_id=data.request_id
         )
-        self.state.send(response.to_dict(), sender)
+        self.state.reply(response, sender)
         self.heartbeat_timer.reset()
 
-    @validate_term
+    @rpc_handler()
     def on_receive_request_vote(self, data: RequestVote, sender: Tuple[str, int]):
-        vote_granted = False
-        if self.storage.voted_for is None or self.storage.voted_for == data.candidate_id:
-            vote_granted = True
-        if data.last_log_term > self.log.last_log_term \
-                or (data.last_log_term == self.log.last_log_term and data.last_log_index >= self.log.last_log_index):
-            vote_granted = True
+        voted_for = self.storage.voted_for
+        last_log_term = self.log.last_log_term
+        # 同一任期只投一票，且候选者的日志不能比自己旧
+        vote_granted = (voted_for is None or voted_for == data.candidate_id) and (
+            data.last_log_term > last_log_term
+            or (data.last_log_term == last_log_term and data.last_log_index >= self.log.last_log_index)
+        )
         if vote_granted:
             self.storage.voted_for = data.candidate_id
         response = RequestVoteResponse(term=self.storage.current_term, vote_granted=vote_granted)
-        self.state.send(response.to_dict(), sender)
+        self.state.reply(response, sender)
 
 
 class Candidate(BaseRole):
     def __init__(self, state: State):
         super().__init__(state)
         self.election_timer = Timer(self.election_interval(), self.state.to_follower, loop=self.loop)
-        self.vote_count = 0
+        self.granted: Set[str] = set()
+        self.denied: Set[str] = set()
 
     def start(self):
         self.init_storage()
-        self.vote_count = 1
+        self.granted = {self.id}
+        self.denied = set()
         self.rpc_request_vote()
         self.election_timer.start()
+        # 单节点集群仅凭自身一票即过半，无需等待投票响应；待本次角色切换完成后再成为leader
+        if self.state.is_majority(len(self.granted)):
+            self.loop.call_soon(self.win_alone)
+
+    def win_alone(self):
+        if self.state.role is self:
+            self.state.to_leader()
 
     def stop(self):
         self.election_timer.stop()
@@ -395,7 +472,7 @@ class Candidate(BaseRole):
 
     @staticmethod
     def election_interval():
-        return random.uniform(*settings.ELECTION_INTERVAL)
+        return settings.ELECTION_INTERVAL_SAMPLER()
 
     def rpc_request_vote(self):
         request = RequestVote(
@@ -404,110 +481,274 @@ class Candidate(BaseRole):
             last_log_index=self.log.last_log_index,
             last_log_term=self.log.last_log_term
         )
-        self.state.broadcast(request.to_dict())
+        self.state.broadcast(request)
 
-    @validate_term
+    @rpc_handler()
     def on_receive_request_vote_response(self, data: RequestVoteResponse, sender: Tuple[str, int]):
-        if data.vote_granted:
-            self.vote_count += 1
-            if self.state.is_majority(self.vote_count):
-                self.state.to_leader()
+        # 按节点去重，重复的响应不重复计票
+        sender_id = self.state.get_server_id(*sender)
+        (self.granted if data.vote_granted else self.denied).add(sender_id)
+        if self.state.is_majority(len(self.granted)):
+            self.state.to_leader()
+        elif not self.state.is_majority(len(self.state.server.cluster) + 1 - len(self.denied)):
+            # 其余节点即使全部同意也无法过半，提前结束本轮选举
+            self.state.to_follower()
 
-    @validate_term
+    @rpc_handler()
     def on_receive_append_entries(self, data: AppendEntries, sender: Tuple[str, int]):
         if data.term == self.storage.current_term:
             self.state.to_follower()
 
 
 class Leader(BaseRole):
+    # 跨任期延续的request_id计数器，达到uint32上限后回绕
+    _next_request_id: int = 0
+    APPLY_FUTURE_RING_SIZE = 1024
+
     def __init__(self, state: State):
         super().__init__(state)
-        self.heartbeat_timer = Timer(settings.HEARTBEAT_INTERVAL, self.heartbeat)
-        self.step_down_timer = Timer(settings.STEP_DOWN_INTERVAL, self.state.to_follower)
+        self.heartbeat_timer = Timer(settings.HEARTBEAT_INTERVAL, self.heartbeat, loop=self.loop)
+        self.step_down_timer = Timer(settings.STEP_DOWN_INTERVAL, self.state.to_follower, loop=self.loop)
+        # leader任期内term不会变化（出现更高任期即转为follower），缓存后发送请求时无需再读取存储
+        self.term: int = self.storage.current_term
         self.request_id = 0
-        self.response_mapping = defaultdict(set)
+        # request_id -> 已响应follower的位掩码，每个follower占一位（位序号见follower_slots）
+        self.response_mapping: Dict[int, int] = {}
+        self.follower_slots: Dict[str, int] = {}
+        # 最近发送的空心跳去掉request_id后的序列化结果，按(任期, prev_log_index, prev_log_term, commit_index)缓存；
+        # 内容未变化时无需重新构建、序列化消息，发送时拼接本轮的request_id即可
+        self.heartbeat_cache: Dict[Tuple[int, int, int, int], bytes] = {}
+        # 等待日志应用的客户端future，按日志索引存放在环形数组中，槽位被占用时存入溢出字典
         # TODO 需要增加异常超时自动清除机制
-        self.apply_future_dict = {}
+        self.apply_futures: List[Optional[Tuple[int, asyncio.Future]]] = [None] * self.APPLY_FUTURE_RING_SIZE
+        self.apply_futures_overflow: Dict[int, asyncio.Future] = {}
+        # 待写入日志的客户端命令，按批写入并只发起一次AppendEntries
+        self.pending_commands: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.flush_lock = asyncio.Lock()
+        # 进行中的批量写入任务及其命令，持有引用以便退位时取消；任务可能尚未开始执行，由stop()直接使其命令失败
+        self.flush_tasks: Dict[asyncio.Task, List[Tuple[Dict[str, Any], asyncio.Future]]] = {}
 
     def start(self):
         self.init_log()
         self.heartbeat()
         self.heartbeat_timer.start()
-        self.step_down_timer.start()
+        # 没有其他节点时不会收到任何响应，无需因失联而退位
+        if self.state.cluster:
+            self.step_down_timer.start()
 
     def stop(self):
         self.heartbeat_timer.stop()
-        self.step_down_timer.stop()
+        if self.step_down_timer.is_active:
+            self.step_down_timer.stop()
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        # 尚未写入的命令及等待应用的日志都不会再由本leader提交，等待方直接收到异常
+        error = RuntimeError(f'leader[{self.id}]已退位，命令未能提交')
+        for task, pending in self.flush_tasks.items():
+            task.cancel()
+            _fail_futures((apply_future for _, apply_future in pending), error)
+        self.flush_tasks = {}
+        _fail_futures((apply_future for _, apply_future in self.pending_commands), error)
+        self.pending_commands = []
+        _fail_futures((item[1] for item in self.apply_futures if item is not None), error)
+        _fail_futures(self.apply_futures_overflow.values(), error)
+        self.apply_futures = [None] * self.APPLY_FUTURE_RING_SIZE
+        self.apply_futures_overflow = {}
 
     def init_log(self):
         self.log.next_index = {follower: self.log.last_log_index + 1 for follower in self.state.cluster}
         self.log.match_index = {follower: 0 for follower in self.state.cluster}
+        self.follower_slots = {follower: slot for slot, follower in enumerate(self.state.cluster)}
 
     def heartbeat(self):
-        self.request_id += 1
-        asyncio.ensure_future(self.loop.run_in_executor(THREAD_POOL_EXECUTOR, self.rpc_append_entries), loop=self.loop)
+        self.request_id = self.next_request_id()
+        self.rpc_append_entries()
+
+    @classmethod
+    def next_request_id(cls) -> int:
+        cls._next_request_id = (cls._next_request_id + 1) & REQUEST_ID_MAX
+        return cls._next_request_id
+
+    @staticmethod
+    def max_in_flight() -> int:
+        """单个follower最多在途（已发送未确认）的日志数"""
+        return settings.APPEND_ENTRIES_MAX_NUM * max(settings.APPEND_ENTRIES_PIPELINE_DEPTH, 1)
 
     def rpc_append_entries(self, server_id: Optional[str] = None):
         server_id_list = [server_id] if server_id else self.state.cluster
+        # next_index相同的follower收到的请求完全一致，按next_index分组后每组只构建、序列化、发送一次
+        groups: Dict[int, List[str]] = defaultdict(list)
         for server_id in server_id_list:
-            next_index = self.log.next_index[server_id]
+            groups[self.log.next_index[server_id]].append(server_id)
+
+        current_term = self.term
+        commit_index = self.log.commit_index
+        max_num = settings.APPEND_ENTRIES_MAX_NUM
+        max_in_flight = self.max_in_flight()
+        for next_index, server_ids in groups.items():
             prev_index = next_index - 1
-            entries = self.log.get_items(next_index, next_index + settings.APPEND_ENTRIES_MAX_NUM) \
-                if self.log.last_log_index >= next_index else []
+            # 在途日志未超出流水线窗口时才发送新日志，否则仅发送心跳
+            in_flight = max(prev_index - self.log.match_index[server_id] for server_id in server_ids)
+            entries = self.log.get_entries_limited(next_index, settings.APPEND_ENTRIES_MAX_BYTES, max_num) \
+                if self.log.last_log_index >= next_index and in_flight < max_in_flight else []
+            prev_log_term = self.log.term_at(prev_index)
+            heartbeat_key = (current_term, prev_index, prev_log_term, commit_index)
+            prefix = None if entries else self.heartbeat_cache.get(heartbeat_key)
+            if prefix is not None:
+                # 与之前发送过的心跳内容相同，只需拼接本轮的request_id
+                self.state.broadcast_packed(AppendEntries.pack_with_request_id(prefix, self.request_id), server_ids)
+                continue
             request = AppendEntries(
-                term=self.storage.current_term,
+                term=current_term,
                 leader_id=self.id,
                 prev_log_index=prev_index,
-                prev_log_term=self.log[prev_index]['term'] if self.log.exists(prev_index) else 0,
+                prev_log_term=prev_log_term,
                 entries=entries,
-                leader_commit=self.log.commit_index,
+                leader_commit=commit_index,
                 request_id=self.request_id
             )
-            self.state.send(request.to_dict(), server_id)
+            self.state.broadcast(request, server_ids)
+            if not entries:
+                prefix = request.pack_without_request_id()
+                if prefix is not None:
+                    if len(self.heartbeat_cache) > len(self.log.next_index):
+                        self.heartbeat_cache.clear()
+                    self.heartbeat_cache[heartbeat_key] = prefix
+            else:
+                # 不等待确认即推进next_index，后续日志可继续发出；丢包或拒绝时由失败响应回退
+                for server_id in server_ids:
+                    self.log.next_index[server_id] = next_index + len(entries)
 
-    @validate_commit_index
-    @validate_term
+    @rpc_handler(apply_commits=True)
     def on_receive_append_entries_response(self, data: AppendEntriesResponse, sender: Tuple[str, int]):
         sender_id = self.state.get_server_id(*sender)
-        self.response_mapping[data.request_id].add(sender_id)
-        if self.state.is_majority(len(self.response_mapping) + 1):
+        slot = self.follower_slots.get(sender_id)
+        if slot is None:
+            return
+        # 同一follower的重复响应只计一次，加上leader自身过半即说明仍与多数节点保持联系
+        mask = self.response_mapping.get(data.request_id, 0) | (1 << slot)
+        if self.state.is_majority(mask.bit_count() + 1):
             self.step_down_timer.reset()
-            del self.response_mapping[data.request_id]
+            # 更早的请求已无需再统计
+            self.response_mapping.clear()
+        else:
+            self.response_mapping[data.request_id] = mask
 
+        match_index = self.log.match_index[sender_id]
         if data.success:
-            if data.last_log_index > self.log.match_index[sender_id]:
-                self.log.next_index[sender_id] = self.log.last_log_index + 1
-                self.log.match_index[sender_id] = self.log.last_log_index
+            if data.last_log_index <= match_index:
+                # 过期或重复的响应，follower已确认过更新的日志，无需据此再次发送
+                return
+            # 以follower确认的本批最后一条日志为准，而不是leader当前的最后一条日志
+            self.log.match_index[sender_id] = data.last_log_index
+            # 流水线发送时next_index可能已超过本次确认的位置，不回退
+            if self.log.next_index[sender_id] <= data.last_log_index:
+                self.log.next_index[sender_id] = data.last_log_index + 1
             self.update_commit_index()
         else:
+            # follower日志较短时直接退到其最后一条日志之后，否则逐条回退；不低于已确认匹配的位置
             next_index = self.log.next_index[sender_id]
-            prev_index = next_index - 1
-            if prev_index > data.last_log_index:
-                self.log.next_index[sender_id] = data.last_log_index + 1
-            else:
-                self.log.next_index[sender_id] = max(next_index - 1, 1)
+            self.log.next_index[sender_id] = max(match_index + 1, min(next_index - 1, data.last_log_index + 1))
 
-        if self.log.last_log_index >= self.log.next_index[sender_id]:
+        # 仍有未发送的日志且在途日志未占满流水线窗口时才继续发送，避免窗口已满时每个响应都触发一次空心跳
+        next_index = self.log.next_index[sender_id]
+        if self.log.last_log_index >= next_index \
+                and next_index - 1 - self.log.match_index[sender_id] < self.max_in_flight():
             self.rpc_append_entries(sender_id)
 
     def update_commit_index(self):
-        committed_on_majority = 0
-        for index in range(self.log.commit_index + 1, self.log.last_log_index + 1):
-            committed_count = len([filter(lambda x: x >= index, self.log.match_index.values())])
-            if self.state.is_majority(committed_count + 1) and self.log[index]['term'] == self.storage.current_term:
-                committed_on_majority = index
-            else:
-                continue
-        if committed_on_majority > self.log.commit_index:
+        # 含leader自身在内按已复制索引降序排列，第N//2个即为过半节点均已复制的最大索引
+        match_indexes = sorted((*self.log.match_index.values(), self.log.last_log_index), reverse=True)
+        committed_on_majority = match_indexes[len(match_indexes) // 2]
+        # 只能直接提交当前任期的日志，之前任期的日志随之一并提交
+        if committed_on_majority > self.log.commit_index \
+                and self.log.term_at(committed_on_majority) == self.term:
             self.log.commit_index = committed_on_majority
 
+    def apply_committed(self):
+        first_index = self.log.last_applied + 1
+        super().apply_committed()
+        for index in range(first_index, self.log.last_applied + 1):
+            apply_future = self.pop_apply_future(index)
+            if apply_future is not None:
+                logger.info('日志序列[%s]已提交', index)
+                if not apply_future.done():
+                    apply_future.set_result(index)
+
+    def add_apply_future(self, index: int, apply_future: asyncio.Future):
+        slot = index % self.APPLY_FUTURE_RING_SIZE
+        if self.apply_futures[slot] is None:
+            self.apply_futures[slot] = (index, apply_future)
+        else:
+            self.apply_futures_overflow[index] = apply_future
+
+    def pop_apply_future(self, index: int) -> Optional[asyncio.Future]:
+        slot = index % self.APPLY_FUTURE_RING_SIZE
+        item = self.apply_futures[slot]
+        if item is not None and item[0] == index:
+            self.apply_futures[slot] = None
+            return item[1]
+        if self.apply_futures_overflow:
+            return self.apply_futures_overflow.pop(index, None)
+        return None
+
+    def flush_pending_commands(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending_commands:
+            return
+        pending, self.pending_commands = self.pending_commands, []
+        task = self.loop.create_task(self.append_pending_commands(pending))
+        self.flush_tasks[task] = pending
+        task.add_done_callback(self.discard_flush_task)
+
+    def discard_flush_task(self, task: asyncio.Task):
+        self.flush_tasks.pop(task, None)
+
+    async def append_pending_commands(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        try:
+            await self._append_pending_commands(pending)
+        except Exception as e:
+            logger.error('批量写入%d条命令失败：%s', len(pending), e)
+            _fail_futures((apply_future for _, apply_future in pending), e)
+
+    async def _append_pending_commands(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        # 串行写入，保证每批日志的索引连续
+        async with self.flush_lock:
+            current_term = self.term
+            entries = [LogEntry(term=current_term, command=command) for command, _ in pending]
+            first_index = await self.loop.run_in_executor(THREAD_POOL_EXECUTOR, self.log.append_entries, entries)
+            for index, (_, apply_future) in enumerate(pending, start=first_index):
+                # 写入期间日志可能已随其他批次复制并应用，此时直接完成
+                if index <= self.log.last_applied:
+                    apply_future.set_result(index)
+                else:
+                    self.add_apply_future(index, apply_future)
+            self.heartbeat_timer.reset()
+            self.rpc_append_entries()
+            # 无需其他节点确认即可提交时（如单节点集群）就地提交并完成等待，不必等待响应触发
+            self.update_commit_index()
+            if self.log.commit_index > self.log.last_applied:
+                self.apply_committed()
+
     async def execute_command(self, command):
-        apply_future = asyncio.Future(loop=self.loop)
-        await self.loop.run_in_executor(
-            THREAD_POOL_EXECUTOR, self.log.append_entry, LogEntry(term=self.storage.current_term, command=command)
-        )
-        self.heartbeat_timer.reset()
-        self.apply_future_dict[self.log.last_log_index] = apply_future
-        await self.loop.run_in_executor(THREAD_POOL_EXECUTOR, self.rpc_append_entries)
+        if not self.state.cluster:
+            # 单节点集群无需合并批次、复制及等待确认，写入后就地提交并应用
+            async with self.flush_lock:
+                entry = LogEntry(term=self.term, command=command)
+                await self.loop.run_in_executor(THREAD_POOL_EXECUTOR, self.log.append_entry, entry)
+                self.log.commit_index = self.log.last_log_index
+                self.apply_committed()
+            logger.debug('命令[%s]已提交', command)
+            return
+        apply_future = self.loop.create_future()
+        self.pending_commands.append((command, apply_future))
+        if len(self.pending_commands) >= settings.APPEND_ENTRIES_MAX_NUM:
+            self.flush_pending_commands()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(settings.APPEND_ENTRIES_BATCH_INTERVAL, self.flush_pending_commands)
         await apply_future
-        logger.debug(f'命令[{command}]已同步发送至其他节点')
+        logger.debug('命令[%s]已同步发送至其他节点', command)
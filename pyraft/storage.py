@@ -7,21 +7,26 @@
 @time: 2023/2/17
 """
 
+import time
+import base64
 import sqlite3
-import traceback
+import threading
+from array import array
 from abc import ABCMeta, abstractmethod
-from typing import Optional, Union, Dict, AnyStr, Any, List
+from typing import Optional, Union, Dict, AnyStr, Any, List, Tuple
 from pathlib import Path
-from collections import defaultdict
-from datetime import datetime
 from contextlib import contextmanager
 
-from pyraft.serializer import AbstractSerializer, JsonSerializer
+from pyraft.serializer import AbstractSerializer, JsonSerializer, MsgPackSerializer
 from pyraft.config import settings
-from pyraft.schema import LogEntry
+from pyraft.schema import LogEntry, get_log_entry_decoder
+from pyraft.log import logger
 
 
-__all__ = ('AbstractDictStorage', 'AbstractListStorage', 'StateStorage', 'LogsStorage', 'StateMachine')
+__all__ = (
+    'AbstractDictStorage', 'AbstractListStorage', 'SQLiteStorage', 'StateStorage', 'LogCache', 'LogsStorage',
+    'StateMachine'
+)
 
 
 cache_dir = Path(settings.LOG_PATH) if isinstance(settings.LOG_PATH, str) else settings.LOG_PATH
@@ -29,25 +34,6 @@ cache_dir.mkdir(parents=True, exist_ok=True)
 DB_URI = (cache_dir / 'pyraft.db').absolute()
 
 
-@contextmanager
-def sqlite(cursor: Optional[sqlite3.Cursor] = None) -> sqlite3.Cursor:
-    if cursor:
-        yield cursor
-        return
-
-    con = sqlite3.connect(DB_URI)
-    cursor = con.cursor()
-    try:
-        yield cursor
-        con.commit()
-    except Exception as e:
-        traceback.print_exception(e)
-        con.rollback()
-    finally:
-        cursor.close()
-        con.close()
-
-
 class AbstractDictStorage(metaclass=ABCMeta):
     @abstractmethod
     def get(self, key: str) -> Any:
@@ -108,13 +94,55 @@ class AbstractListStorage(metaclass=ABCMeta):
         return self.get_item(index)
 
 
-class StateStorage(AbstractDictStorage):
+class SQLiteStorage:
+    """持有一个sqlite连接并在实例的整个生命周期内复用，不再每次读写都建立、关闭连接
+
+    leader的日志写入在独立线程中执行，连接允许跨线程使用，由实例锁保证同一时刻只有一个线程在使用
+    """
+
+    def __init__(self, pragmas: Tuple[str, ...] = ()):
+        """
+        :param pragmas: 在公共的SQLITE_PRAGMAS之后执行的、仅作用于本连接的PRAGMA
+        """
+        self._con = sqlite3.connect(DB_URI, check_same_thread=False)
+        self._lock = threading.RLock()
+        for pragma in (*settings.SQLITE_PRAGMAS, *pragmas):
+            self._con.execute(f'pragma {pragma}')
+
+    @contextmanager
+    def sqlite(self, cursor: Optional[sqlite3.Cursor] = None) -> sqlite3.Cursor:
+        if cursor:
+            yield cursor
+            return
+
+        with self._lock:
+            cursor = self._con.cursor()
+            try:
+                yield cursor
+                self._con.commit()
+            except Exception:
+                logger.exception('sqlite事务执行失败，已回滚')
+                self._con.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+
+class StateStorage(AbstractDictStorage, SQLiteStorage):
     def __init__(self, server_id: str):
+        super().__init__(settings.SQLITE_STATE_PRAGMAS)
         self.table_name = f'state_{server_id.replace(".", "_").replace(":", "_")}'
         self._init_db()
+        # 全部键值在内存中保留一份，读取时不再访问数据库；写入时同步落库
+        with self.sqlite() as db:
+            self._values: Dict[str, str] = dict(db.execute(self._sql_get_all).fetchall())
 
     def _init_db(self):
-        with sqlite() as db:
+        with self.sqlite() as db:
             db.execute(
                 f"""
                     create table if not exists {self.table_name} (
@@ -123,29 +151,35 @@ class StateStorage(AbstractDictStorage):
                     )
                 """
             )
+        # 表名由节点ID确定，语句只拼接一次，取值均以参数绑定，sqlite可复用已编译的语句
+        self._sql_get_all = f"select key, value from {self.table_name}"
+        self._sql_update = f"update {self.table_name} set value = ? where key = ?"
+        self._sql_insert = f"insert into {self.table_name} (key, value) values (?, ?)"
 
     def get(self, key: str, cursor: sqlite3.Cursor = None) -> Any:
-        with sqlite(cursor) as db:
-            res = db.execute(f"select value from {self.table_name} where key='{key}'")
-            value = res.fetchone()
-        if not value:
-            raise KeyError(f'{self.__class__.__name__}中不存在键[{key}]')
-        return value[0]
+        try:
+            return self._values[key]
+        except KeyError:
+            raise KeyError(f'{self.__class__.__name__}中不存在键[{key}]') from None
 
     def set(self, key: str, value: AnyStr, cursor: sqlite3.Cursor = None) -> Optional[str]:
-        with sqlite(cursor) as db:
-            try:
-                v = self.get(key, db)
-                if v != value:
-                    db.execute(f"update {self.table_name} set value='{value}' where key='{key}'")
-                return value
-            except KeyError:
-                db.execute(f"insert into {self.table_name} (key, value) values ('{key}', '{value}')")
-                return value
+        return self.update({key: value}, cursor)[0]
 
     def update(self, kwargs: Dict[str, AnyStr], cursor: sqlite3.Cursor = None) -> List[Optional[str]]:
-        with sqlite(cursor) as db:
-            return [self.set(key, value, db) for key, value in kwargs.items()]
+        """任期、投票须先落盘再对外响应：事务提交成功后才更新内存中的值，回滚时内存不会领先于库中的数据
+
+        传入cursor时由调用方的事务负责提交，内存中的值在本方法返回时即已更新
+        """
+        changed = {key: value for key, value in kwargs.items() if key not in self._values or self._values[key] != value}
+        if changed:
+            with self.sqlite(cursor) as db:
+                for key, value in changed.items():
+                    if key in self._values:
+                        db.execute(self._sql_update, (value, key))
+                    else:
+                        db.execute(self._sql_insert, (key, value))
+            self._values.update(changed)
+        return list(kwargs.values())
 
     @property
     def current_term(self) -> int:
@@ -157,107 +191,247 @@ class StateStorage(AbstractDictStorage):
 
     @property
     def voted_for(self) -> Union[str, int, None]:
-        return self.get('voted_for')
+        # None以字符串形式存储
+        value = self.get('voted_for')
+        return None if value == 'None' else value
 
     @voted_for.setter
-    def voted_for(self, value: Union[str, int]):
-        self.set('voted_for', value)
-
-
-class LogsStorage(AbstractListStorage):
+    def voted_for(self, value: Union[str, int, None]):
+        self.set('voted_for', str(value))
+
+
+class LogCache:
+    """最近写入日志项的环形缓存，按日志索引对容量取模定位槽位，新写入的项覆盖旧项"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots: List[Optional[Tuple[int, Any]]] = [None] * size
+
+    def get(self, index: int) -> Any:
+        slot = self._slots[index % self.size] if self.size else None
+        if slot is None or slot[0] != index:
+            raise KeyError(index)
+        return slot[1]
+
+    def get_range(self, start_index: int, end_index: int) -> Optional[List[Any]]:
+        """区间内任一项未命中时返回None"""
+        if end_index - start_index >= self.size:
+            return None
+        items = []
+        for index in range(start_index, end_index + 1):
+            slot = self._slots[index % self.size]
+            if slot is None or slot[0] != index:
+                return None
+            items.append(slot[1])
+        return items
+
+    def put(self, index: int, item: Any) -> None:
+        if self.size:
+            self._slots[index % self.size] = (index, item)
+
+    def erase_from(self, index: int) -> None:
+        for i, slot in enumerate(self._slots):
+            if slot is not None and slot[0] > index:
+                self._slots[i] = None
+
+
+class LogsStorage(AbstractListStorage, SQLiteStorage):
     def __init__(
             self,
             server_id: str,
             serializer: Optional[AbstractSerializer] = None
     ):
+        super().__init__(settings.SQLITE_LOGS_PRAGMAS)
         self.table_name = f'logs_{server_id.replace(".", "_").replace(":", "_")}'
         self.serializer = serializer or settings.SERIALIZER or JsonSerializer()
+        self.cache = LogCache(settings.LOG_CACHE_SIZE)
+        self._unpack = get_log_entry_decoder(self.serializer)
         self._init_db()
+        # 各日志项的任期及序列化后的字节数按索引连续存放（_terms[i - 1]为索引i的任期），随写入/截断同步更新，
+        # 最后一条日志的索引、任期、任意位置的任期及按字节数切分日志均无需查询数据库
+        self._terms, self._sizes = self._load_index()
 
         self.commit_index = 0
         self.last_applied = 0
-        self.next_index = defaultdict(int)
-        self.match_index = defaultdict(int)
+        # 仅leader使用，成为leader时按集群节点一次性初始化，之后只按已知节点ID读写
+        self.next_index: Dict[str, int] = {}
+        self.match_index: Dict[str, int] = {}
 
     def _init_db(self):
-        with sqlite() as db:
+        with self.sqlite() as db:
             db.execute(
                 f"""
                     create table if not exists {self.table_name} (
                         idx integer primary key,
-                        entry varchar(100) not null,
+                        entry blob not null,
                         datetime timestamp not null 
                     )
                 """
             )
-
-    def get_item(self, index: int, cursor: sqlite3.Cursor = None) -> Any:
-        with sqlite(cursor) as db:
-            sql = f"select entry from {self.table_name} where idx = {index}"
-            res = db.execute(sql)
-            item = res.fetchone()
-        if not item:
-            raise IndexError(f'{self.__class__.__name__}中不存在索引为[{index}]的项')
-        return self.serializer.unpack(item[0])
+        self._sql_get = f"select entry from {self.table_name} where idx = ?"
+        self._sql_get_from = f"select idx, entry from {self.table_name} where idx >= ?"
+        self._sql_get_range = f"select idx, entry from {self.table_name} where idx >= ? and idx <= ?"
+        self._sql_insert = f"insert into {self.table_name} (entry, datetime) values (?, ?)"
+        self._sql_erase_from = f"delete from {self.table_name} where idx > ?"
+        self._migrate_legacy_rows()
+
+    def _migrate_legacy_rows(self):
+        """旧版本以文本形式落库（MsgPackSerializer的结果经过base64编码），启动时一次性转换为当前的二进制格式"""
+        with self.sqlite() as db:
+            rows = db.execute(f"select idx, entry from {self.table_name} where typeof(entry) = 'text'").fetchall()
+            if not rows:
+                return
+            decode = base64.b64decode if isinstance(self.serializer, MsgPackSerializer) else bytes
+            db.executemany(
+                f"update {self.table_name} set entry = ? where idx = ?",
+                [(decode(entry.encode('utf8')), index) for index, entry in rows]
+            )
+        logger.info('%s中%d条旧格式日志已转换', self.table_name, len(rows))
+
+    def _load_index(self) -> Tuple[array, array]:
+        terms, sizes = array('q'), array('q')
+        with self.sqlite() as db:
+            res = db.execute(f"select entry from {self.table_name} order by idx")
+            for entry, in res.fetchall():
+                terms.append(self._unpack(entry).term)
+                sizes.append(len(entry))
+        return terms, sizes
+
+    def get_entry(self, index: int, cursor: sqlite3.Cursor = None) -> LogEntry:
+        with self._lock:
+            try:
+                return self.cache.get(index)
+            except KeyError:
+                pass
+            with self.sqlite(cursor) as db:
+                res = db.execute(self._sql_get, (index,))
+                item = res.fetchone()
+            if not item:
+                raise IndexError(f'{self.__class__.__name__}中不存在索引为[{index}]的项')
+            entry = self._unpack(item[0])
+            self.cache.put(index, entry)
+            return entry
+
+    def get_item(self, index: int, cursor: sqlite3.Cursor = None) -> Dict:
+        return self.get_entry(index, cursor).to_dict()
 
     def count(self, cursor: sqlite3.Cursor = None) -> int:
-        with sqlite(cursor) as db:
+        with self.sqlite(cursor) as db:
             res = db.execute(f"select count(*) from {self.table_name}")
             return int(res.fetchone()[0])
 
-    def append_item(self, item: Any, cursor: sqlite3.Cursor = None) -> None:
-        with sqlite(cursor) as db:
-            db.execute(
-                f"insert into {self.table_name} (entry, datetime) values (?, ?)",
-                (self.serializer.pack(item).decode("utf8"), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            )
+    def get_entries(
+            self,
+            start_index: Optional[int] = 1,
+            end_index: Optional[int] = None,
+            cursor: sqlite3.Cursor = None
+    ) -> List[LogEntry]:
+        with self._lock:
+            last_index = len(self._terms)
+            if start_index > last_index:
+                raise ValueError(f'查询起始索引[{start_index}]越界')
+            if end_index and end_index < start_index:
+                raise ValueError(f'查询截止索引[{end_index}]应大于等于起始索引[{start_index}]')
+            cached = self.cache.get_range(start_index, min(end_index or last_index, last_index))
+            if cached is not None:
+                return cached
+            with self.sqlite(cursor) as db:
+                if end_index:
+                    res = db.execute(self._sql_get_range, (start_index, end_index))
+                else:
+                    res = db.execute(self._sql_get_from, (start_index,))
+                entries = []
+                for index, packed in res.fetchall():
+                    entry = self._unpack(packed)
+                    self.cache.put(index, entry)
+                    entries.append(entry)
+                return entries
 
     def get_items(
             self,
             start_index: Optional[int] = 1,
             end_index: Optional[int] = None,
             cursor: sqlite3.Cursor = None
-    ) -> List[Any]:
-        with sqlite(cursor) as db:
-            if start_index > self.count(db):
-                raise ValueError(f'查询起始索引[{start_index}]越界')
-            sql = f"select entry from {self.table_name} where idx >= {start_index}"
-            if end_index:
-                if end_index < start_index:
-                    raise ValueError(f'查询截止索引[{end_index}]应大于等于起始索引[{start_index}]')
-                sql = f'{sql} and idx <= {end_index}'
-            res = db.execute(sql)
-            return [self.serializer.unpack(item[0]) for item in res.fetchall()]
-
-    def append_items(self, items: List[Any], cursor: sqlite3.Cursor = None) -> None:
-        with sqlite(cursor) as db:
-            db.executemany(
-                f"insert into {self.table_name} (entry, datetime) values (?, ?)",
-                [(self.serializer.pack(item).decode("utf8"), datetime.now().strftime("%Y-%m-%d %H:%M:%S")) for item in items]
-            )
+    ) -> List[Dict]:
+        return [entry.to_dict() for entry in self.get_entries(start_index, end_index, cursor)]
+
+    def append_entries(self, entries: List[Union[LogEntry, Dict]], cursor: sqlite3.Cursor = None) -> int:
+        """日志项以LogEntry对象缓存，读取时无需再次反序列化；落库格式仍为{'term', 'command'}字典
+
+        :return: 写入的第一条日志的索引
+        """
+        entries = [entry if isinstance(entry, LogEntry) else LogEntry(**entry) for entry in entries]
+        packed = [self.serializer.pack(entry.to_dict()) for entry in entries]
+        # leader在日志线程中写入，事件循环线程同时读取索引，写入及内存索引的更新须在同一把锁内完成
+        with self._lock:
+            first_index = len(self._terms) + 1
+            if not entries:
+                return first_index
+            with self.sqlite(cursor) as db:
+                # 写入时间仅作记录、不参与读取，以整数秒存储，无需格式化
+                now = int(time.time())
+                db.executemany(
+                    self._sql_insert,
+                    [(item, now) for item in packed]
+                )
+            # 事务提交成功后再更新内存中的索引及缓存，写入失败时异常已抛出，两者不会不一致
+            for index, entry in enumerate(entries, start=first_index):
+                self.cache.put(index, entry)
+            self._terms.extend(entry.term for entry in entries)
+            self._sizes.extend(len(item) for item in packed)
+        return first_index
+
+    def append_entry(self, entry: Union[LogEntry, Dict], cursor: sqlite3.Cursor = None) -> int:
+        return self.append_entries([entry], cursor)
+
+    def append_item(self, item: Dict, cursor: sqlite3.Cursor = None) -> None:
+        self.append_entries([item], cursor)
+
+    def append_items(self, items: List[Dict], cursor: sqlite3.Cursor = None) -> None:
+        self.append_entries(items, cursor)
 
     def erase_from(self, index: int, cursor: sqlite3.Cursor = None):
-        with sqlite(cursor) as db:
-            db.execute(f"delete from {self.table_name} where idx > {index}")
+        with self._lock:
+            with self.sqlite(cursor) as db:
+                db.execute(self._sql_erase_from, (index,))
+            self.cache.erase_from(index)
+            del self._terms[max(index, 0):]
+            del self._sizes[max(index, 0):]
+
+    def get_entries_limited(self, start_index: int, max_bytes: int, max_count: int) -> List[LogEntry]:
+        """自start_index起按序读取日志，数量不超过max_count且序列化后总字节数不超过max_bytes，至少返回一条"""
+        with self._lock:
+            last_index = min(len(self._terms), start_index + max_count - 1)
+            end_index, total = start_index, self._sizes[start_index - 1]
+            while end_index < last_index:
+                total += self._sizes[end_index]
+                if total > max_bytes:
+                    break
+                end_index += 1
+            return self.get_entries(start_index, end_index)
 
-    def append_entry(self, entry: LogEntry) -> None:
-        self.append_item(entry.to_dict())
+    def exists(self, index: int) -> bool:
+        with self._lock:
+            return 1 <= index <= len(self._terms)
 
-    def append_entries(self, entries: List[Union[LogEntry, Dict]]):
-        self.append_items([entry.to_dict() if isinstance(entry, LogEntry) else entry for entry in entries])
+    def term_at(self, index: int) -> int:
+        """索引为index的日志的任期，index为0（空日志之前的位置）时返回0"""
+        if index == 0:
+            return 0
+        with self._lock:
+            if not 1 <= index <= len(self._terms):
+                raise IndexError(f'{self.__class__.__name__}中不存在索引为[{index}]的项')
+            return self._terms[index - 1]
 
     @property
-    def last_log_index(self):
-        return self.count()
+    def last_log_index(self) -> int:
+        with self._lock:
+            return len(self._terms)
 
     @property
-    def last_log_term(self):
-        with sqlite() as db:
-            last_log_index = self.count(db)
-            if last_log_index:
-                item = self.get_item(last_log_index, cursor=db)
-                return item['term']
-            return 0
+    def last_log_term(self) -> int:
+        with self._lock:
+            return self._terms[-1] if self._terms else 0
 
 
 class StateMachine(AbstractDictStorage):
@@ -273,8 +447,12 @@ class StateMachine(AbstractDictStorage):
         self._cache[key] = value
 
     def update(self, kwargs):
-        for key, value in kwargs.items():
-            self.set(key, value)
+        self._cache.update(kwargs)
 
     def apply(self, command: Dict[str, Any]) -> None:
         self.update(command)
+
+    def apply_batch(self, commands: List[Dict[str, Any]]) -> None:
+        update = self._cache.update
+        for command in commands:
+            update(command)
@@ -12,21 +12,41 @@ from typing import Optional, Callable
 
 
 class Timer:
+    """周期定时器
+
+    reset只推迟截止时间，不取消、重建已注册的回调：回调到期时若截止时间已被推迟，则按新的截止时间重新注册
+    """
+
     def __init__(self, interval: float, callback: Callable, loop: Optional[asyncio.AbstractEventLoop] = None):
         self.interval = interval
         self.callback = callback
-        self.loop = loop or asyncio.get_event_loop()
+        self.loop = loop
         self.is_active = False
-        self._handler = None
+        self._handler: Optional[asyncio.TimerHandle] = None
+        self._deadline = 0.0
+        # 启动时绑定事件循环的time/call_at，reset及到期回调中不再逐次查找属性
+        self._time: Optional[Callable[[], float]] = None
+        self._call_at: Optional[Callable[..., asyncio.TimerHandle]] = None
 
     def start(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self._time, self._call_at = self.loop.time, self.loop.call_at
         self.is_active = True
-        self._handler = self.loop.call_later(self.interval, self._run)
+        self._deadline = self._time() + self.interval
+        self._handler = self._call_at(self._deadline, self._run)
 
     def _run(self):
+        if not self.is_active:
+            return
+        deadline = self._deadline
+        if self._time() < deadline:
+            self._handler = self._call_at(deadline, self._run)
+            return
+        self.callback()
         if self.is_active:
-            self.callback()
-            self._handler = self.loop.call_later(self.interval, self._run)
+            self._deadline = deadline = self._time() + self.interval
+            self._handler = self._call_at(deadline, self._run)
 
     def stop(self):
         self.is_active = False
@@ -35,5 +55,8 @@ class Timer:
         self._handler.cancel()
 
     def reset(self):
-        self.stop()
-        self.start()
+        if not self.is_active:
+            self.stop()
+            self.start()
+            return
+        self._deadline = self._time() + self.interval
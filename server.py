@@ -9,7 +9,7 @@
 
 import asyncio
 
-from pyraft.run import start, stop
+from pyraft.run import start, stop, new_event_loop
 from pyraft.state import State
 from pyraft.log import logger
 
@@ -32,7 +32,7 @@ async def main(index):
         if State.get_leader() == server_id:
             from datetime import datetime
             t = datetime.now().timestamp()
-            logger.debug(f'准备设置参数[test]，值为{t}')
+            logger.debug('准备设置参数[test]，值为%s', t)
             await State.set_value('test', t)
 
 
@@ -42,7 +42,7 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--index', help="Current server's index", type=int, default=0)
     args = parser.parse_args()
     try:
-        loop = asyncio.get_event_loop()
+        loop = new_event_loop()
         loop.run_until_complete(main(args.index))
     except KeyboardInterrupt:
         stop()
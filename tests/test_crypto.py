@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_crypto
+@time: 2026/10/15
+"""
+
+import itertools
+import threading
+import unittest
+
+from pyraft.crypto import AESCryptor, generate_aes_key
+
+
+class AESCryptorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cryptor = AESCryptor(generate_aes_key())
+
+    def test_encrypt_decrypt(self):
+        enc_text = self.cryptor.encrypt(b'12345')
+        self.assertEqual(len(enc_text), AESCryptor.NONCE_SIZE + 5 + 16)
+        self.assertEqual(self.cryptor.decrypt(enc_text), b'12345')
+
+    def test_nonce_unique(self):
+        nonces = [self.cryptor.encrypt(b'')[:AESCryptor.NONCE_SIZE] for _ in range(1000)]
+        self.assertEqual(len(set(nonces)), len(nonces))
+
+    def test_nonce_unique_across_threads(self):
+        nonces = []
+        lock = threading.Lock()
+
+        def worker():
+            items = [self.cryptor._next_nonce() for _ in range(2000)]
+            with lock:
+                nonces.extend(items)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(nonces)), len(nonces))
+
+    def test_nonce_rotation(self):
+        # 计数器即将用尽时，下一个nonce应更换前缀并从0重新计数
+        self.cryptor._nonce_counter = itertools.count(AESCryptor.NONCE_COUNTER_MAX)
+        last = self.cryptor._next_nonce()
+        rotated = self.cryptor._next_nonce()
+        following = self.cryptor._next_nonce()
+
+        prefix_size = AESCryptor.NONCE_PREFIX_SIZE
+        self.assertEqual(last[prefix_size:], AESCryptor.NONCE_COUNTER_MAX.to_bytes(4, 'big'))
+        self.assertNotEqual(rotated[:prefix_size], last[:prefix_size])
+        self.assertEqual(rotated[prefix_size:], (0).to_bytes(4, 'big'))
+        self.assertEqual(following[:prefix_size], rotated[:prefix_size])
+        self.assertEqual(following[prefix_size:], (1).to_bytes(4, 'big'))
+
+        enc_text = self.cryptor.encrypt(b'after rotation')
+        self.assertEqual(self.cryptor.decrypt(enc_text), b'after rotation')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_framing
+@time: 2026/10/15
+"""
+
+import unittest
+from unittest import mock
+
+from pyraft.framing import FRAME_HEADER_SIZE, pack_frame, unpack_frame
+from pyraft.network import UDPProtocol
+from pyraft.log import logger
+
+
+class FramingTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for data in (b'', b'x', bytes(range(256)) * 300):
+            with self.subTest(size=len(data)):
+                frame = pack_frame(data)
+                self.assertEqual(len(frame), FRAME_HEADER_SIZE + len(data))
+                self.assertEqual(unpack_frame(frame), data)
+
+    def test_shorter_than_header(self):
+        with self.assertRaises(ValueError):
+            unpack_frame(pack_frame(b'data')[:FRAME_HEADER_SIZE - 1])
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            unpack_frame(pack_frame(b'data')[:-1])
+
+    def test_trailing_data(self):
+        with self.assertRaises(ValueError):
+            unpack_frame(pack_frame(b'data') + b'x')
+
+
+class UDPProtocolFramingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.request_handler = mock.Mock()
+        self.protocol = UDPProtocol(self.request_handler, mock.Mock(), framing_enabled=True, loop=mock.Mock())
+        self.transport = mock.Mock()
+        self.transport.get_write_buffer_size.return_value = 0
+        self.protocol.connection_made(self.transport)
+
+    def test_send_framed(self):
+        self.protocol.send(b'data', ('127.0.0.1', 8091))
+        self.transport.sendto.assert_called_once_with(pack_frame(b'data'), ('127.0.0.1', 8091))
+
+    def test_receive_framed(self):
+        self.protocol.datagram_received(pack_frame(b'data'), ('127.0.0.1', 8091))
+        self.request_handler.assert_called_once_with(b'data', ('127.0.0.1', 8091))
+
+    def test_drop_truncated_frame(self):
+        with self.assertLogs(logger, 'WARNING'):
+            self.protocol.datagram_received(pack_frame(b'data')[:-1], ('127.0.0.1', 8091))
+        self.request_handler.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_network
+@time: 2026/10/15
+"""
+
+import socket
+import unittest
+from unittest import mock
+
+from pyraft import network
+from pyraft.network import UDPProtocol
+
+ADDRS = (('127.0.0.1', 8091), ('127.0.0.1', 8092), ('127.0.0.1', 8093))
+
+
+class UDPProtocolBroadcastTestCase(unittest.TestCase):
+    def setUp(self):
+        self.protocol = UDPProtocol(mock.Mock(), mock.Mock(), framing_enabled=False, loop=mock.Mock())
+        self.transport = mock.Mock()
+        self.transport.get_write_buffer_size.return_value = 0
+        self.protocol.connection_made(self.transport)
+
+    def sendto_addrs(self):
+        return [call.args[1] for call in self.transport.sendto.call_args_list]
+
+    def test_partial_sendmmsg_falls_back_to_sendto(self):
+        with mock.patch.object(self.protocol, '_sendmmsg', return_value=1) as sendmmsg:
+            self.protocol.broadcast(b'data', ADDRS)
+        sendmmsg.assert_called_once_with(b'data', ADDRS)
+        # sendmmsg未发出的报文逐个sendto
+        self.assertEqual(self.sendto_addrs(), list(ADDRS[1:]))
+
+    def test_single_addr_uses_sendto(self):
+        with mock.patch.object(self.protocol, '_sendmmsg') as sendmmsg:
+            self.protocol.broadcast(b'data', ADDRS[:1])
+        sendmmsg.assert_not_called()
+        self.assertEqual(self.sendto_addrs(), list(ADDRS[:1]))
+
+    def test_buffered_transport_uses_sendto(self):
+        # transport中仍有积压数据时不绕过其缓冲区
+        self.transport.get_write_buffer_size.return_value = 1
+        self.protocol.broadcast(b'data', ADDRS)
+        self.transport.get_extra_info.assert_not_called()
+        self.assertEqual(self.sendto_addrs(), list(ADDRS))
+
+    def test_unpackable_addr_uses_sendto(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        self.transport.get_extra_info.return_value = sock
+        addrs = (*ADDRS[:2], ('localhost', 8093))
+        self.assertEqual(self.protocol._sendmmsg(b'data', addrs), 0)
+        self.assertIsNone(self.protocol._get_sockaddr(('localhost', 8093)))
+
+    @unittest.skipIf(network._sendmmsg is None, 'sendmmsg不可用')
+    def test_sendmmsg(self):
+        receivers = []
+        for _ in range(3):
+            receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.addCleanup(receiver.close)
+            receiver.bind(('127.0.0.1', 0))
+            receiver.settimeout(1)
+            receivers.append(receiver)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        self.transport.get_extra_info.return_value = sock
+
+        self.protocol.broadcast(b'data', [receiver.getsockname() for receiver in receivers])
+        self.transport.sendto.assert_not_called()
+        for receiver in receivers:
+            self.assertEqual(receiver.recv(16), b'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
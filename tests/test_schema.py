@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_schema
+@time: 2026/10/15
+"""
+
+import json
+import unittest
+from unittest import mock
+
+import msgspec
+
+from pyraft.config import settings
+from pyraft.serializer import AbstractSerializer, JsonSerializer, MsgPackSerializer
+from pyraft.schema import REQUEST_ID_MAX, LogEntry, RequestVote, RequestVoteResponse, AppendEntries, \
+    AppendEntriesResponse, get_rpc_decoder, get_log_entry_decoder
+
+
+class StdJsonSerializer(AbstractSerializer):
+    """不基于msgspec的自定义序列化器"""
+
+    def pack(self, data):
+        return json.dumps(data).encode(self.encoding)
+
+    def unpack(self, data):
+        return json.loads(data)
+
+
+MESSAGES = (
+    RequestVote(term=3, candidate_id='127.0.0.1:8091', last_log_index=10, last_log_term=2),
+    RequestVoteResponse(term=3, vote_granted=True),
+    AppendEntries(
+        term=3,
+        leader_id='127.0.0.1:8091',
+        prev_log_index=10,
+        prev_log_term=2,
+        entries=[LogEntry(term=3, command={'a': 1}), LogEntry(term=3, command={'b': [1, 2]})],
+        leader_commit=9,
+        request_id=0xFFFFFFFF
+    ),
+    AppendEntriesResponse(term=3, success=False, last_log_index=8, last_log_term=2, request_id=7),
+)
+
+
+class RPCMessageTestCase(unittest.TestCase):
+    def assert_round_trip(self, serializer: AbstractSerializer):
+        decode = get_rpc_decoder(serializer)
+        with mock.patch.object(settings, 'SERIALIZER', serializer):
+            for message in MESSAGES:
+                # 重新构建实例，避免复用其他序列化器缓存的序列化结果
+                message = msgspec.structs.replace(message)
+                with self.subTest(message=type(message).__name__):
+                    self.assertEqual(decode(message.to_packed()), message)
+                    buffer = bytearray()
+                    message.pack_into(buffer)
+                    self.assertEqual(decode(bytes(buffer)), message)
+
+    def test_msgpack_round_trip(self):
+        self.assert_round_trip(MsgPackSerializer())
+
+    def test_json_round_trip(self):
+        self.assert_round_trip(JsonSerializer())
+
+    def test_custom_serializer_round_trip(self):
+        self.assert_round_trip(StdJsonSerializer())
+
+    def test_from_dict(self):
+        for message in MESSAGES:
+            self.assertEqual(type(message).from_dict(message.to_dict()), message)
+
+    def test_invalid_message(self):
+        decode = get_rpc_decoder(MsgPackSerializer())
+        with self.assertRaises(msgspec.DecodeError):
+            decode(msgspec.msgpack.encode(['unknown', 1]))
+
+    def test_request_id_out_of_range(self):
+        with self.assertRaises(ValueError):
+            AppendEntries(
+                term=1, leader_id='a', prev_log_index=0, prev_log_term=0, entries=[], leader_commit=0,
+                request_id=0xFFFFFFFF + 1
+            )
+
+
+class LogEntryTestCase(unittest.TestCase):
+    def test_log_entry_round_trip(self):
+        entry = LogEntry(term=2, command={'key': 'value'})
+        for serializer in (MsgPackSerializer(), JsonSerializer(), StdJsonSerializer()):
+            with self.subTest(serializer=type(serializer).__name__):
+                decode = get_log_entry_decoder(serializer)
+                self.assertEqual(decode(serializer.pack(entry.to_dict())), entry)
+
+
+class HeartbeatPrefixTestCase(unittest.TestCase):
+    def test_splice_request_id(self):
+        heartbeat = AppendEntries(
+            term=3, leader_id='127.0.0.1:8091', prev_log_index=10, prev_log_term=2, entries=[], leader_commit=9,
+            request_id=1
+        )
+        for serializer in (MsgPackSerializer(), JsonSerializer()):
+            with mock.patch.object(settings, 'SERIALIZER', serializer):
+                prefix = msgspec.structs.replace(heartbeat).pack_without_request_id()
+                # 覆盖msgpack中不同长度的整数编码
+                for request_id in (0, 1, 127, 128, 255, 256, 65535, 65536, REQUEST_ID_MAX):
+                    with self.subTest(serializer=type(serializer).__name__, request_id=request_id):
+                        expected = msgspec.structs.replace(heartbeat, request_id=request_id).to_packed()
+                        self.assertEqual(AppendEntries.pack_with_request_id(prefix, request_id), expected)
+
+    def test_custom_serializer_not_cached(self):
+        with mock.patch.object(settings, 'SERIALIZER', StdJsonSerializer()):
+            heartbeat = AppendEntries(
+                term=3, leader_id='127.0.0.1:8091', prev_log_index=10, prev_log_term=2, entries=[],
+                leader_commit=9, request_id=1
+            )
+            self.assertIsNone(heartbeat.pack_without_request_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_state
+@time: 2026/10/15
+"""
+
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List, Tuple, Any, Optional
+from unittest import mock
+
+import msgspec
+
+from pyraft import storage
+from pyraft.config import settings
+from pyraft.schema import LogEntry, RequestVote, RequestVoteResponse, AppendEntries, AppendEntriesResponse, \
+    get_rpc_decoder
+from pyraft.serializer import MsgPackSerializer
+from pyraft.state import State, Follower, Candidate, Leader
+
+LEADER = ('127.0.0.1', 8091)
+PEERS = ('127.0.0.1:8091', '127.0.0.1:8093')
+# 五节点集群中的其他节点
+PEERS_OF_FIVE = (*PEERS, '127.0.0.1:8094', '127.0.0.1:8095')
+
+
+class FakeServer:
+    def __init__(self, cluster_ids: Tuple[str, ...]):
+        self.cluster = cluster_ids
+        self.majority_threshold = (len(cluster_ids) + 1) // 2
+
+
+class FakeState:
+    """只提供各角色处理消息所需的属性，发出的消息及角色切换分别记录在replies、broadcasts、transitions中"""
+
+    get_server_id = staticmethod(State.get_server_id)
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, cluster: Tuple[str, ...] = ()):
+        self.loop = loop
+        self.id = '127.0.0.1:8092'
+        self.storage = storage.StateStorage(self.id)
+        self.log = storage.LogsStorage(self.id, MsgPackSerializer())
+        self.state_machine = storage.StateMachine()
+        self.server = FakeServer(cluster)
+        self.cluster = cluster
+        self.role = None
+        self.leader = None
+        self.replies: List[Tuple[Any, Tuple[str, int]]] = []
+        self.broadcasts: List[Tuple[Any, List[str]]] = []
+        self.transitions: List[str] = []
+        self._decode = get_rpc_decoder(self.log.serializer)
+
+    def set_leader(self, leader):
+        self.leader = leader
+
+    def reply(self, data, sender: Tuple[str, int]):
+        self.replies.append((data, sender))
+
+    def broadcast(self, data, dests: Optional[List[str]] = None):
+        self.broadcasts.append((data, list(dests or self.cluster)))
+
+    def broadcast_packed(self, packed: bytes, dests: Optional[List[str]] = None):
+        self.broadcast(self._decode(packed), dests)
+
+    def is_majority(self, count: int) -> bool:
+        return count > self.server.majority_threshold
+
+    def to_follower(self):
+        self.transitions.append('follower')
+
+    def to_candidate(self):
+        self.transitions.append('candidate')
+
+    def to_leader(self):
+        self.transitions.append('leader')
+
+
+class StateTestCase(unittest.TestCase):
+    cluster: Tuple[str, ...] = ()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(storage, 'DB_URI', Path(self.tmp_dir.name) / 'pyraft.db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.state = FakeState(self.loop, self.cluster)
+        self.state.storage.current_term = 2
+        self.log = self.state.log
+
+    def tearDown(self):
+        self.state.storage.close()
+        self.log.close()
+        self.loop.close()
+        self.tmp_dir.cleanup()
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+
+class FollowerAppendEntriesTestCase(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.follower = Follower(self.state)
+        self.follower.start()
+
+    def tearDown(self):
+        self.follower.stop()
+        super().tearDown()
+
+    def append_entries(self, prev_log_index: int, prev_log_term: int, terms: Tuple[int, ...], leader_commit: int,
+                       term: int = 2) -> AppendEntriesResponse:
+        entries = [LogEntry(term=t, command={'index': prev_log_index + i}) for i, t in enumerate(terms, start=1)]
+        request = AppendEntries(
+            term=term,
+            leader_id='127.0.0.1:8091',
+            prev_log_index=prev_log_index,
+            prev_log_term=prev_log_term,
+            entries=entries,
+            leader_commit=leader_commit,
+            request_id=len(self.state.replies)
+        )
+        self.follower.on_receive_append_entries(request, LEADER)
+        response, sender = self.state.replies[-1]
+        self.assertEqual(sender, LEADER)
+        self.assertEqual(response.request_id, request.request_id)
+        return response
+
+    def terms(self) -> List[int]:
+        return [self.log.term_at(i) for i in range(1, self.log.last_log_index + 1)]
+
+    def test_append_and_commit(self):
+        response = self.append_entries(0, 0, (1, 1, 2), leader_commit=2)
+        self.assertTrue(response.success)
+        self.assertEqual(response.last_log_index, 3)
+        self.assertEqual(response.last_log_term, 2)
+        self.assertEqual(self.terms(), [1, 1, 2])
+        self.assertEqual(self.log.commit_index, 2)
+        self.assertEqual(self.log.last_applied, 2)
+        self.assertEqual(self.state.state_machine.get('index'), 2)
+
+    def test_commit_index_limited_by_match_index(self):
+        self.append_entries(0, 0, (1, 1, 2), leader_commit=0)
+        # leader已提交到更后的位置，但本批只确认到索引2
+        self.append_entries(1, 1, (1,), leader_commit=10)
+        self.assertEqual(self.log.commit_index, 2)
+
+    def test_commit_index_never_regresses(self):
+        self.append_entries(0, 0, (1, 1, 2), leader_commit=3)
+        # 乱序到达的旧请求
+        response = self.append_entries(0, 0, (1,), leader_commit=1)
+        self.assertTrue(response.success)
+        self.assertEqual(self.log.commit_index, 3)
+        self.assertEqual(self.terms(), [1, 1, 2])
+
+    def test_reject_missing_prev_log(self):
+        self.append_entries(0, 0, (1,), leader_commit=0)
+        response = self.append_entries(3, 1, (2,), leader_commit=0)
+        self.assertFalse(response.success)
+        self.assertEqual(response.last_log_index, 1)
+        self.assertEqual(self.terms(), [1])
+
+    def test_reject_prev_log_term_mismatch(self):
+        self.append_entries(0, 0, (1, 1), leader_commit=0)
+        response = self.append_entries(2, 2, (2,), leader_commit=0)
+        self.assertFalse(response.success)
+        self.assertEqual(self.terms(), [1, 1])
+
+    def test_truncate_conflicting_entries(self):
+        self.append_entries(0, 0, (1, 1, 1, 1), leader_commit=1)
+        response = self.append_entries(1, 1, (1, 2), leader_commit=1)
+        self.assertTrue(response.success)
+        self.assertEqual(response.last_log_index, 3)
+        # 自第一个冲突的位置起截断并追加
+        self.assertEqual(self.terms(), [1, 1, 2])
+        self.assertEqual(self.log.get_entry(3).term, 2)
+
+    def test_existing_entries_not_truncated(self):
+        self.append_entries(0, 0, (1, 1, 1), leader_commit=0)
+        response = self.append_entries(0, 0, (1,), leader_commit=0)
+        self.assertTrue(response.success)
+        self.assertEqual(response.last_log_index, 1)
+        self.assertEqual(self.terms(), [1, 1, 1])
+
+    def test_reject_stale_term(self):
+        response = self.append_entries(0, 0, (1,), leader_commit=1, term=1)
+        self.assertFalse(response.success)
+        self.assertEqual(response.term, 2)
+        self.assertEqual(self.log.last_log_index, 0)
+        self.assertIsNone(self.state.leader)
+
+
+class FollowerRequestVoteTestCase(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.follower = Follower(self.state)
+        self.follower.start()
+        self.log.append_entries([LogEntry(term=1, command={}), LogEntry(term=2, command={})])
+
+    def tearDown(self):
+        self.follower.stop()
+        super().tearDown()
+
+    def request_vote(self, candidate_id: str, last_log_index: int = 2, last_log_term: int = 2, term: int = 2) -> bool:
+        request = RequestVote(
+            term=term, candidate_id=candidate_id, last_log_index=last_log_index, last_log_term=last_log_term
+        )
+        host, port = candidate_id.split(':')
+        self.follower.on_receive_request_vote(request, (host, int(port)))
+        return self.state.replies[-1][0].vote_granted
+
+    def test_one_vote_per_term(self):
+        self.assertTrue(self.request_vote(PEERS[0]))
+        self.assertEqual(self.state.storage.voted_for, PEERS[0])
+        self.assertFalse(self.request_vote(PEERS[1]))
+        # 同一候选者重复请求仍可获得投票
+        self.assertTrue(self.request_vote(PEERS[0]))
+
+    def test_vote_cleared_on_new_term(self):
+        self.assertTrue(self.request_vote(PEERS[0]))
+        self.assertTrue(self.request_vote(PEERS[1], term=3))
+        self.assertEqual(self.state.storage.current_term, 3)
+        self.assertEqual(self.state.storage.voted_for, PEERS[1])
+
+    def test_reject_outdated_log(self):
+        self.assertFalse(self.request_vote(PEERS[0], last_log_index=5, last_log_term=1))
+        self.assertFalse(self.request_vote(PEERS[0], last_log_index=1, last_log_term=2))
+        self.assertIsNone(self.state.storage.voted_for)
+        self.assertTrue(self.request_vote(PEERS[0], last_log_index=1, last_log_term=3))
+
+
+class CandidateTestCase(StateTestCase):
+    cluster = PEERS_OF_FIVE
+
+    def setUp(self):
+        super().setUp()
+        self.candidate = Candidate(self.state)
+        self.state.role = self.candidate
+        self.candidate.start()
+
+    def tearDown(self):
+        self.candidate.stop()
+        super().tearDown()
+
+    def vote(self, server_id: str, vote_granted: bool):
+        host, port = server_id.split(':')
+        response = RequestVoteResponse(term=self.state.storage.current_term, vote_granted=vote_granted)
+        self.candidate.on_receive_request_vote_response(response, (host, int(port)))
+
+    def test_start_election(self):
+        self.assertEqual(self.state.storage.current_term, 3)
+        self.assertEqual(self.state.storage.voted_for, self.state.id)
+        request, dests = self.state.broadcasts[-1]
+        self.assertIsInstance(request, RequestVote)
+        self.assertEqual(request.term, 3)
+        self.assertEqual(dests, list(self.cluster))
+
+    def test_win_on_granted_majority(self):
+        self.vote(self.cluster[0], True)
+        # 重复的响应不重复计票
+        self.vote(self.cluster[0], True)
+        self.assertEqual(self.state.transitions, [])
+        self.vote(self.cluster[1], True)
+        self.assertEqual(self.state.transitions, ['leader'])
+
+    def test_give_up_when_majority_unreachable(self):
+        self.vote(self.cluster[0], False)
+        self.vote(self.cluster[1], False)
+        self.vote(self.cluster[1], False)
+        # 自身及剩余两个节点仍可过半
+        self.assertEqual(self.state.transitions, [])
+        self.vote(self.cluster[2], False)
+        self.assertEqual(self.state.transitions, ['follower'])
+
+
+class LeaderTestCase(StateTestCase):
+    cluster = PEERS
+
+    def setUp(self):
+        super().setUp()
+        self.leader = Leader(self.state)
+        self.state.role = self.leader
+        self.leader.start()
+        self.state.broadcasts.clear()
+        self.tasks: List[asyncio.Task] = []
+
+    def tearDown(self):
+        flush_tasks = list(self.leader.flush_tasks)
+        self.leader.stop()
+        # 等待被取消或失败的任务结束，避免关闭事件循环时仍有未完成的任务
+        pending = [*self.tasks, *flush_tasks]
+        if pending:
+            self.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        super().tearDown()
+
+    def respond(self, server_id: str, last_log_index: int, success: bool = True, request_id: Optional[int] = None):
+        host, port = server_id.split(':')
+        response = AppendEntriesResponse(
+            term=2,
+            success=success,
+            last_log_index=last_log_index,
+            last_log_term=2,
+            request_id=self.leader.request_id if request_id is None else request_id
+        )
+        self.leader.on_receive_append_entries_response(response, (host, int(port)))
+
+    def execute_commands(self, *commands: dict) -> List[asyncio.Task]:
+        tasks = [self.loop.create_task(self.leader.execute_command(command)) for command in commands]
+        self.tasks.extend(tasks)
+        # 让各命令进入待写入队列
+        self.run_until_complete(asyncio.sleep(0))
+        return tasks
+
+    def flush(self):
+        self.leader.flush_pending_commands()
+        self.run_until_complete(asyncio.gather(*self.leader.flush_tasks))
+
+
+class LeaderBatchTestCase(LeaderTestCase):
+    def test_commands_batched(self):
+        tasks = self.execute_commands({'a': 1}, {'b': 2}, {'c': 3})
+        self.assertEqual(len(self.leader.pending_commands), 3)
+        self.flush()
+        # 三条命令一次写入，每个follower只收到一次AppendEntries
+        self.assertEqual(self.log.last_log_index, 3)
+        self.assertEqual(len(self.state.broadcasts), 1)
+        request, dests = self.state.broadcasts[0]
+        self.assertEqual([entry.command for entry in request.entries], [{'a': 1}, {'b': 2}, {'c': 3}])
+        self.assertEqual(sorted(dests), list(PEERS))
+        self.assertFalse(any(task.done() for task in tasks))
+
+        # 一个follower确认后即过半，命令提交并应用
+        self.respond(PEERS[0], 3)
+        self.run_until_complete(asyncio.gather(*tasks))
+        self.assertEqual(self.log.commit_index, 3)
+        self.assertEqual(self.state.state_machine.get('c'), 3)
+
+    def test_full_batch_flushed_immediately(self):
+        with mock.patch.object(settings, 'APPEND_ENTRIES_MAX_NUM', 2):
+            self.execute_commands({'a': 1}, {'b': 2})
+            self.assertEqual(self.leader.pending_commands, [])
+            self.assertIsNone(self.leader.flush_handle)
+            self.assertEqual(len(self.leader.flush_tasks), 1)
+            self.run_until_complete(asyncio.gather(*self.leader.flush_tasks))
+        self.assertEqual(self.log.last_log_index, 2)
+
+    def test_stop_fails_queued_and_unapplied_commands(self):
+        unapplied = self.execute_commands({'a': 1})
+        self.flush()
+        queued = self.execute_commands({'b': 2})
+        self.leader.stop()
+        for task in (*unapplied, *queued):
+            with self.assertRaises(RuntimeError):
+                self.run_until_complete(task)
+        self.assertEqual(self.leader.pending_commands, [])
+        self.assertEqual(self.leader.apply_futures_overflow, {})
+        self.assertTrue(all(item is None for item in self.leader.apply_futures))
+
+    def test_stop_fails_batch_of_cancelled_flush(self):
+        tasks = self.execute_commands({'a': 1}, {'b': 2})
+        # 批量写入任务尚未开始执行即被取消
+        self.leader.flush_pending_commands()
+        flush_tasks = list(self.leader.flush_tasks)
+        self.leader.stop()
+        for task in tasks:
+            with self.assertRaises(RuntimeError):
+                self.run_until_complete(task)
+        self.assertEqual(self.leader.flush_tasks, {})
+        self.run_until_complete(asyncio.gather(*flush_tasks, return_exceptions=True))
+        self.assertTrue(all(task.cancelled() for task in flush_tasks))
+
+
+class LeaderHeartbeatTestCase(LeaderTestCase):
+    def test_heartbeat_reuses_cached_prefix(self):
+        self.leader.heartbeat()
+        with mock.patch.object(self.state, 'broadcast_packed', wraps=self.state.broadcast_packed) as broadcast_packed:
+            self.leader.heartbeat()
+        broadcast_packed.assert_called_once()
+        (first, _), (second, _) = self.state.broadcasts
+        self.assertEqual(len(self.leader.heartbeat_cache), 1)
+        # 内容相同，仅request_id为本轮的值
+        self.assertEqual(second.request_id, self.leader.request_id)
+        self.assertEqual(msgspec.structs.replace(second, request_id=first.request_id), first)
+
+    def test_heartbeat_rebuilt_after_commit_change(self):
+        self.leader.heartbeat()
+        self.log.commit_index = 1
+        self.leader.heartbeat()
+        self.assertEqual(self.state.broadcasts[-1][0].leader_commit, 1)
+
+
+class LeaderPipelineTestCase(LeaderTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, value in (('APPEND_ENTRIES_MAX_NUM', 2), ('APPEND_ENTRIES_PIPELINE_DEPTH', 2)):
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.log.append_entries([LogEntry(term=2, command={'index': index}) for index in range(1, 11)])
+        # follower尚未复制任何日志
+        self.follower_id = PEERS[0]
+        self.log.next_index[self.follower_id] = 1
+
+    def sent_indexes(self) -> List[List[int]]:
+        return [
+            [request.prev_log_index + i for i in range(1, len(request.entries) + 1)]
+            for request, _ in self.state.broadcasts
+        ]
+
+    def test_next_index_advanced_without_ack(self):
+        self.leader.rpc_append_entries(self.follower_id)
+        self.assertEqual(self.log.next_index[self.follower_id], 3)
+        # 不等待确认即可发出下一批
+        self.leader.rpc_append_entries(self.follower_id)
+        self.assertEqual(self.log.next_index[self.follower_id], 5)
+        self.assertEqual(self.sent_indexes(), [[1, 2], [3, 4]])
+
+    def test_ack_does_not_move_next_index_back(self):
+        self.leader.rpc_append_entries(self.follower_id)
+        self.leader.rpc_append_entries(self.follower_id)
+        self.respond(self.follower_id, 2)
+        self.assertEqual(self.log.match_index[self.follower_id], 2)
+        self.assertGreaterEqual(self.log.next_index[self.follower_id], 5)
+
+    def test_reject_moves_next_index_back(self):
+        self.leader.rpc_append_entries(self.follower_id)
+        self.leader.rpc_append_entries(self.follower_id)
+        self.respond(self.follower_id, 1, success=False)
+        # 退回到follower最后一条日志之后，并从该位置重新发送
+        self.assertEqual(self.sent_indexes()[-1], [2, 3])
+        self.assertEqual(self.log.next_index[self.follower_id], 4)
+
+    def test_in_flight_capped_by_pipeline_depth(self):
+        for _ in range(3):
+            self.leader.rpc_append_entries(self.follower_id)
+        # 每批2条、深度为2，在途4条后只发送心跳，next_index不再前进
+        self.assertEqual(self.sent_indexes(), [[1, 2], [3, 4], []])
+        self.assertEqual(self.log.next_index[self.follower_id], 5)
+
+        # 确认一批后窗口腾出空间，继续发送
+        self.respond(self.follower_id, 2)
+        self.assertEqual(self.sent_indexes()[-1], [5, 6])
+        self.assertEqual(self.log.next_index[self.follower_id], 7)
+
+    def test_ack_with_full_window_sends_nothing(self):
+        self.log.next_index[self.follower_id] = 7
+        self.respond(self.follower_id, 2)
+        # 确认后在途日志仍占满窗口，不再为此发送空心跳
+        self.assertEqual(self.state.broadcasts, [])
+        self.assertEqual(self.log.match_index[self.follower_id], 2)
+
+    def test_duplicate_ack_sends_nothing(self):
+        self.leader.rpc_append_entries(self.follower_id)
+        self.leader.rpc_append_entries(self.follower_id)
+        self.respond(self.follower_id, 2)
+        sent = len(self.state.broadcasts)
+        self.respond(self.follower_id, 2)
+        self.assertEqual(len(self.state.broadcasts), sent)
+
+    def test_ack_when_caught_up_sends_nothing(self):
+        self.log.next_index[self.follower_id] = 11
+        self.respond(self.follower_id, 10)
+        self.assertEqual(self.state.broadcasts, [])
+        self.assertEqual(self.log.commit_index, 10)
+
+
+class LeaderCommitIndexTestCase(LeaderTestCase):
+    cluster = PEERS_OF_FIVE
+
+    def set_match_index(self, *match_indexes: int):
+        self.log.match_index.update(zip(self.cluster, match_indexes))
+        self.leader.update_commit_index()
+
+    def test_commit_majority_match_index(self):
+        self.log.append_entries([LogEntry(term=2, command={}) for _ in range(5)])
+        # 含leader自身为5, 5, 3, 1, 0，过半节点均已复制到3
+        self.set_match_index(5, 3, 1, 0)
+        self.assertEqual(self.log.commit_index, 3)
+        # commit_index不回退
+        self.set_match_index(0, 0, 0, 0)
+        self.assertEqual(self.log.commit_index, 3)
+
+    def test_commit_current_term_only(self):
+        self.log.append_entries([LogEntry(term=term, command={}) for term in (1, 1, 1, 2, 2)])
+        # 过半节点已复制到的日志属于之前的任期，不能直接提交
+        self.set_match_index(3, 3, 0, 0)
+        self.assertEqual(self.log.commit_index, 0)
+        # 当前任期的日志提交后，之前任期的日志随之提交
+        self.set_match_index(4, 4, 0, 0)
+        self.assertEqual(self.log.commit_index, 4)
+
+
+class LeaderAckTestCase(LeaderTestCase):
+    cluster = PEERS_OF_FIVE
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(self.leader.step_down_timer, 'reset')
+        self.step_down_reset = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_majority_acks_reset_step_down_timer(self):
+        request_id = self.leader.request_id
+        self.respond(self.cluster[0], 0)
+        # 同一follower的重复响应只计一次
+        self.respond(self.cluster[0], 0)
+        self.assertEqual(self.leader.response_mapping, {request_id: 1})
+        self.step_down_reset.assert_not_called()
+
+        self.respond(self.cluster[2], 0)
+        self.step_down_reset.assert_called_once()
+        self.assertEqual(self.leader.response_mapping, {})
+
+    def test_acks_counted_per_request(self):
+        self.respond(self.cluster[0], 0, request_id=1)
+        self.respond(self.cluster[1], 0, request_id=2)
+        self.assertEqual(self.leader.response_mapping, {1: 0b01, 2: 0b10})
+        self.step_down_reset.assert_not_called()
+
+    def test_unknown_sender_ignored(self):
+        self.respond('127.0.0.1:9999', 0)
+        self.assertEqual(self.leader.response_mapping, {})
+
+
+class SingleNodeTestCase(StateTestCase):
+    def test_candidate_wins_alone(self):
+        candidate = Candidate(self.state)
+        self.state.role = candidate
+        candidate.start()
+        # 单节点仅凭自身一票即过半，角色切换完成后成为leader
+        self.assertEqual(self.state.transitions, [])
+        self.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.state.transitions, ['leader'])
+        candidate.stop()
+
+    def test_execute_command(self):
+        leader = Leader(self.state)
+        self.state.role = leader
+        leader.start()
+        self.assertFalse(leader.step_down_timer.is_active)
+
+        self.run_until_complete(leader.execute_command({'a': 1}))
+        self.run_until_complete(leader.execute_command({'b': 2}))
+        # 无需等待其他节点确认，写入后即提交并应用
+        self.assertEqual(self.log.last_log_index, 2)
+        self.assertEqual(self.log.commit_index, 2)
+        self.assertEqual(self.log.last_applied, 2)
+        self.assertEqual(self.state.state_machine.get('b'), 2)
+        self.assertEqual(leader.pending_commands, [])
+        self.assertIsNone(leader.flush_handle)
+        leader.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_storage
+@time: 2026/10/15
+"""
+
+import time
+import base64
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+from unittest import mock
+
+from pyraft import storage
+from pyraft.schema import LogEntry
+from pyraft.serializer import AbstractSerializer, JsonSerializer, MsgPackSerializer
+
+
+class LogsStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(storage, 'DB_URI', Path(self.tmp_dir.name) / 'pyraft.db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.log = storage.LogsStorage('127.0.0.1:8091', MsgPackSerializer())
+        # 任期依次为1, 1, 2, 2, 3
+        self.entries = [LogEntry(term=term, command={'i': i}) for i, term in enumerate((1, 1, 2, 2, 3), start=1)]
+        self.log.append_entries(self.entries)
+
+    def tearDown(self):
+        self.log.close()
+        self.tmp_dir.cleanup()
+
+    def reopen(self) -> storage.LogsStorage:
+        self.log.close()
+        self.log = storage.LogsStorage('127.0.0.1:8091', MsgPackSerializer())
+        return self.log
+
+    def test_term_at(self):
+        self.assertEqual(self.log.term_at(0), 0)
+        self.assertEqual([self.log.term_at(i) for i in range(1, 6)], [1, 1, 2, 2, 3])
+        self.assertEqual(self.log.last_log_index, 5)
+        self.assertEqual(self.log.last_log_term, 3)
+        with self.assertRaises(IndexError):
+            self.log.term_at(6)
+
+    def test_term_at_after_reopen(self):
+        log = self.reopen()
+        self.assertEqual([log.term_at(i) for i in range(1, 6)], [1, 1, 2, 2, 3])
+        self.assertEqual(log.get_entries(1), self.entries)
+
+    def test_erase_from(self):
+        self.log.erase_from(2)
+        self.assertEqual(self.log.last_log_index, 2)
+        self.assertEqual(self.log.last_log_term, 1)
+        self.assertFalse(self.log.exists(3))
+        with self.assertRaises(IndexError):
+            self.log.get_entry(3)
+        with self.assertRaises(ValueError):
+            self.log.get_entries(3)
+
+        # 截断后追加的日志不应读到缓存中被覆盖前的旧项
+        new_entry = LogEntry(term=4, command={'new': True})
+        self.log.append_entry(new_entry)
+        self.assertEqual(self.log.get_entry(3), new_entry)
+        self.assertEqual(self.log.get_entries(1), [*self.entries[:2], new_entry])
+        self.assertEqual(self.reopen().get_entries(1), [*self.entries[:2], new_entry])
+
+    def test_erase_all(self):
+        self.log.erase_from(0)
+        self.assertEqual(self.log.last_log_index, 0)
+        self.assertEqual(self.log.last_log_term, 0)
+        self.assertEqual(self.log.count(), 0)
+
+    def test_get_entries_limited_by_count(self):
+        self.assertEqual(self.log.get_entries_limited(2, 1 << 20, 2), self.entries[1:3])
+        self.assertEqual(self.log.get_entries_limited(4, 1 << 20, 10), self.entries[3:])
+
+    def test_get_entries_limited_by_bytes(self):
+        size = self.log._sizes[0]
+        self.assertEqual(self.log.get_entries_limited(1, size * 2, 10), self.entries[:2])
+        # 单条日志已超出字节上限时仍返回一条
+        self.assertEqual(self.log.get_entries_limited(1, 1, 10), self.entries[:1])
+
+
+class LegacyRowsMigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        patcher = mock.patch.object(storage, 'DB_URI', Path(self.tmp_dir.name) / 'pyraft.db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.entries = [LogEntry(term=1, command={'a': 1}), LogEntry(term=2, command={'b': [1, 2]})]
+
+    def open_with_legacy_rows(self, serializer: AbstractSerializer, rows: List[str]) -> storage.LogsStorage:
+        log = storage.LogsStorage('127.0.0.1:8091', serializer)
+        table_name = log.table_name
+        log.close()
+        con = sqlite3.connect(storage.DB_URI)
+        with con:
+            con.executemany(
+                f"insert into {table_name} (entry, datetime) values (?, ?)", [(row, int(time.time())) for row in rows]
+            )
+        con.close()
+
+        log = storage.LogsStorage('127.0.0.1:8091', serializer)
+        self.addCleanup(log.close)
+        return log
+
+    def assert_migrated(self, log: storage.LogsStorage):
+        self.assertEqual(log.get_entries(1), self.entries)
+        self.assertEqual([log.term_at(1), log.term_at(2)], [1, 2])
+        with log.sqlite() as db:
+            types = db.execute(f"select distinct typeof(entry) from {log.table_name}").fetchall()
+        self.assertEqual(types, [('blob',)])
+
+    def test_msgpack_base64_rows(self):
+        serializer = MsgPackSerializer()
+        rows = [base64.b64encode(serializer.pack(entry.to_dict())).decode() for entry in self.entries]
+        self.assert_migrated(self.open_with_legacy_rows(serializer, rows))
+
+    def test_json_text_rows(self):
+        serializer = JsonSerializer()
+        rows = [serializer.pack(entry.to_dict()).decode() for entry in self.entries]
+        self.assert_migrated(self.open_with_legacy_rows(serializer, rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+@author: wang_chao03
+@project: pyraft
+@file: test_timer
+@time: 2026/10/15
+"""
+
+import unittest
+from typing import List, Tuple, Callable
+from unittest import mock
+
+from pyraft.timer import Timer
+
+
+class FakeLoop:
+    """手动推进时间的事件循环，只提供Timer所需的time/call_at"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.scheduled: List[Tuple[float, Callable, mock.Mock]] = []
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback: Callable) -> mock.Mock:
+        handle = mock.Mock()
+        self.scheduled.append((when, callback, handle))
+        return handle
+
+    def run_next(self):
+        """推进到最早的回调并执行"""
+        self.scheduled.sort(key=lambda item: item[0])
+        when, callback, handle = self.scheduled.pop(0)
+        self.now = when
+        if not handle.cancel.called:
+            callback()
+
+
+class TimerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.callback = mock.Mock()
+        self.timer = Timer(1.0, self.callback, loop=self.loop)
+        self.timer.start()
+
+    def test_periodic(self):
+        self.loop.run_next()
+        self.loop.run_next()
+        self.assertEqual(self.callback.call_count, 2)
+        self.assertEqual(self.loop.scheduled[0][0], 3.0)
+
+    def test_reset_pushes_deadline(self):
+        self.loop.now = 0.5
+        self.timer.reset()
+        # reset只推迟截止时间，不注册新的回调
+        self.assertEqual(len(self.loop.scheduled), 1)
+
+        self.loop.run_next()
+        self.callback.assert_not_called()
+        self.assertEqual(self.loop.scheduled[0][0], 1.5)
+
+        self.loop.run_next()
+        self.callback.assert_called_once()
+        self.assertEqual(self.loop.scheduled[0][0], 2.5)
+
+    def test_stop(self):
+        self.timer.stop()
+        self.assertFalse(self.timer.is_active)
+        self.loop.run_next()
+        self.callback.assert_not_called()
+        self.assertEqual(self.loop.scheduled, [])
+
+    def test_reset_after_stop_restarts(self):
+        self.timer.stop()
+        self.loop.now = 5.0
+        self.timer.reset()
+        self.assertTrue(self.timer.is_active)
+        self.assertEqual(self.loop.scheduled[-1][0], 6.0)
+
+
+if __name__ == '__main__':
+    unittest.main()